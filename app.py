@@ -1,9 +1,10 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from src.config.mongodb import db
-from src.config.firebase import initialize_firebase
+from src.config.mongodb import ping, get_pool_stats
+from src.config.lifecycle import init_worker, with_lifespan
+from src.config.server import ThreadedWsgiToAsgi
 from src.middleware.auth_middleware import token_required
-from asgiref.wsgi import WsgiToAsgi
+import os
 
 # Import controllers
 from src.controller.child_controller import child_controller
@@ -16,8 +17,15 @@ from src.controller.knowledge_base_controller import knowledge_base_controller
 app = Flask(__name__)
 CORS(app)
 
-# Initialize Firebase
-initialize_firebase()
+# Server settings
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+# Firebase, signing keys and MongoDB indexes are initialized per worker process from the
+# ASGI lifespan startup event; this covers servers that do not send lifespan events
+@app.before_request
+def ensure_worker_initialized():
+    init_worker()
 
 # Register blueprints
 app.register_blueprint(child_controller)
@@ -31,6 +39,13 @@ app.register_blueprint(knowledge_base_controller)
 def health_check():
     return jsonify({"status": "healthy", "message": "API is running"}), 200
 
+# Readiness probe, fails while MongoDB is unreachable
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    if not ping():
+        return jsonify({"status": "unavailable", "message": "MongoDB is not reachable"}), 503
+    return jsonify({"status": "ready", "mongo_pool": get_pool_stats()}), 200
+
 # Protected route example
 @app.route('/api/protected', methods=['GET'])
 @token_required
@@ -41,9 +56,16 @@ def protected():
         "user": user
     }), 200
 
-# Convert Flask app to ASGI for async support
-asgi_app = WsgiToAsgi(app)
+# Convert Flask app to ASGI for async support, serving up to WEB_THREADS requests at once per worker
+asgi_app = with_lifespan(ThreadedWsgiToAsgi(app))
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(asgi_app, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Workers import the app by name and initialize their own clients on lifespan startup
+    uvicorn.run(
+        "app:asgi_app",
+        host='0.0.0.0',
+        port=5000,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT
+    )
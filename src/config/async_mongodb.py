@@ -0,0 +1,101 @@
+from pymongo import AsyncMongoClient
+from concurrent.futures import ThreadPoolExecutor
+from src.config.mongodb import uri, DB_NAME, client_options
+from src.config.lifecycle import register_shutdown, get_server_loop
+import threading
+import asyncio
+import os
+
+# An async driver client is bound to the loop it first runs on. Under the ASGI server async views
+# run on the worker's server loop, so the client lives there and views await it directly. Without
+# a server loop (scripts, the Flask dev server, asyncio.run in job threads) the client runs on one
+# long-lived loop in a background thread that other loops reach through thread-safe futures.
+mongo_loop = None
+owns_mongo_loop = False
+mongo_loop_lock = threading.Lock()
+async_client = None
+
+# Shared pool for the remaining blocking helpers so views can still run them concurrently
+blocking_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASYNC_BLOCKING_WORKERS", "16")),
+    thread_name_prefix="blocking-io"
+)
+
+@register_shutdown
+def close_async_client():
+    global mongo_loop, owns_mongo_loop, async_client
+    blocking_executor.shutdown(wait=True)
+    with mongo_loop_lock:
+        if mongo_loop is not None:
+            if async_client is not None:
+                asyncio.run_coroutine_threadsafe(async_client.close(), mongo_loop).result(timeout=10)
+            if owns_mongo_loop:
+                mongo_loop.call_soon_threadsafe(mongo_loop.stop)
+        mongo_loop = None
+        owns_mongo_loop = False
+        async_client = None
+
+def get_mongo_loop():
+    global mongo_loop, owns_mongo_loop
+    with mongo_loop_lock:
+        if mongo_loop is None:
+            server_loop = get_server_loop()
+            if server_loop is not None and server_loop.is_running():
+                mongo_loop = server_loop
+            else:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="mongo-async", daemon=True).start()
+                mongo_loop = loop
+                owns_mongo_loop = True
+    return mongo_loop
+
+def get_async_db():
+    global async_client
+    with mongo_loop_lock:
+        if async_client is None:
+            async_client = AsyncMongoClient(uri, **client_options())
+    return async_client[DB_NAME]
+
+async def on_mongo_loop(coroutine):
+    loop = get_mongo_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coroutine
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    return await asyncio.wrap_future(future)
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, fn, *args)
+
+class AsyncCollection:
+    # Awaitable counterpart of a pymongo collection that is safe to use from any event loop
+    def __init__(self, name):
+        self.name = name
+
+    def collection(self):
+        return get_async_db()[self.name]
+
+    async def find_one(self, *args, **kwargs):
+        return await on_mongo_loop(self.collection().find_one(*args, **kwargs))
+
+    async def find(self, *args, **kwargs):
+        async def fetch():
+            return await self.collection().find(*args, **kwargs).to_list(None)
+        return await on_mongo_loop(fetch())
+
+    async def insert_one(self, *args, **kwargs):
+        return await on_mongo_loop(self.collection().insert_one(*args, **kwargs))
+
+    async def update_one(self, *args, **kwargs):
+        return await on_mongo_loop(self.collection().update_one(*args, **kwargs))
+
+    async def delete_one(self, *args, **kwargs):
+        return await on_mongo_loop(self.collection().delete_one(*args, **kwargs))
+
+    async def count_documents(self, *args, **kwargs):
+        return await on_mongo_loop(self.collection().count_documents(*args, **kwargs))
+
+    async def aggregate(self, pipeline, **kwargs):
+        async def fetch():
+            cursor = await self.collection().aggregate(pipeline, **kwargs)
+            return await cursor.to_list(None)
+        return await on_mongo_loop(fetch())
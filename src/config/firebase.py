@@ -1,11 +1,124 @@
 import firebase_admin
 from firebase_admin import credentials, auth
 from dotenv import load_dotenv
+from cachetools import TLRUCache
+from cryptography import x509
+import requests
+import jwt
+import threading
+import argparse
+import datetime
+import hashlib
+import logging
+import time
+import re
 import os
 
 load_dotenv()
 
-def initialize_firebase():
+# Verified token cache settings
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE_ENABLED", "true").lower() == "true"
+
+# Decoded tokens keyed by a hash of the raw token, each entry expires at the token's own `exp`
+token_cache = TLRUCache(
+    maxsize=TOKEN_CACHE_SIZE,
+    ttu=lambda key, decoded_token, now: decoded_token.get("exp", now),
+    timer=time.time
+)
+token_cache_lock = threading.Lock()
+token_cache_stats = {"hits": 0, "misses": 0}
+
+# Signing key settings
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+SIGNING_KEYS_REFRESH_MARGIN = int(os.getenv("SIGNING_KEYS_REFRESH_MARGIN", "300"))  # seconds before expiry
+SIGNING_KEYS_RETRY_INTERVAL = int(os.getenv("SIGNING_KEYS_RETRY_INTERVAL", "30"))
+TOKEN_CLOCK_SKEW = int(os.getenv("TOKEN_CLOCK_SKEW", "0"))
+
+def fetch_google_certs():
+    # Returns the x509 certificates keyed by kid and how long they may be cached
+    response = requests.get(FIREBASE_CERTS_URL, timeout=10)
+    response.raise_for_status()
+    max_age = 3600
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    if match:
+        max_age = int(match.group(1))
+    return response.json(), max_age
+
+class SigningKeyManager:
+    def __init__(self, key_source=fetch_google_certs, refresh_margin=SIGNING_KEYS_REFRESH_MARGIN,
+                 retry_interval=SIGNING_KEYS_RETRY_INTERVAL):
+        # key_source is any callable returning ({kid: pem_certificate}, max_age_seconds)
+        self.key_source = key_source
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.keys = {}
+        self.expires_at = 0
+        self.attempted_at = 0
+        self.refresh_requested = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def refresh(self):
+        self.attempted_at = time.monotonic()
+        certs, max_age = self.key_source()
+        keys = {
+            kid: x509.load_pem_x509_certificate(pem.encode("utf-8")).public_key()
+            for kid, pem in certs.items()
+        }
+        # Swap the whole key set at once so readers never see a partial update
+        self.keys = keys
+        self.expires_at = time.time() + max_age
+        logging.info(f"Loaded {len(keys)} Firebase signing keys, valid for {max_age}s")
+
+    def start(self):
+        # The first load happens at startup so no request ever waits on it
+        self.refresh()
+        self.thread = threading.Thread(target=self.run, name="firebase-signing-keys", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.refresh_requested.set()
+
+    def run(self):
+        delay = self.next_refresh_delay()
+        while not self.stopped.is_set():
+            self.refresh_requested.wait(timeout=delay)
+            # Fetch at most once per retry_interval, so tokens with bogus kids cannot drive a fetch loop;
+            # requests arriving in the meantime are served by the one delayed fetch
+            remaining = self.attempted_at + self.retry_interval - time.monotonic()
+            if remaining > 0:
+                self.stopped.wait(remaining)
+            self.refresh_requested.clear()
+            if self.stopped.is_set():
+                break
+            try:
+                self.refresh()
+                delay = self.next_refresh_delay()
+            except Exception as e:
+                logging.error(f"Error refreshing Firebase signing keys: {str(e)}")
+                delay = self.retry_interval
+
+    def next_refresh_delay(self):
+        return max(self.expires_at - time.time() - self.refresh_margin, self.retry_interval)
+
+    def request_refresh(self):
+        self.refresh_requested.set()
+
+    def get_key(self, kid):
+        key = self.keys.get(kid)
+        if key is None:
+            # Unknown kid usually means a rotation we have not seen yet; refresh in the background
+            self.request_refresh()
+        return key
+
+    def is_ready(self):
+        return bool(self.keys) and time.time() < self.expires_at
+
+signing_keys = None
+
+def initialize_firebase(key_source=None):
     try:
         # # Create credential dictionary from environment variables
         # cred_dict = {
@@ -25,16 +138,180 @@ def initialize_firebase():
         cred_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'store', 'firebase.credentials.json')
         cred = credentials.Certificate(cred_path)
  
-        firebase_admin.initialize_app(cred)
+        # A worker forked from an initialized parent already has the default app
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(cred)
     except Exception as e:
         print(f"Error initializing Firebase: {e}")
         raise e
 
-def verify_token(id_token):
+    start_signing_key_manager(key_source or fetch_google_certs)
+
+def stop_signing_key_manager():
+    global signing_keys
+    if signing_keys is not None:
+        signing_keys.stop()
+        signing_keys = None
+
+def start_signing_key_manager(key_source):
+    global signing_keys
+    # The refresh thread does not survive a fork, so each worker starts its own
+    stop_signing_key_manager()
+    manager = SigningKeyManager(key_source=key_source)
+    try:
+        manager.start()
+        signing_keys = manager
+    except Exception as e:
+        # Fall back to firebase_admin verification until keys can be loaded
+        logging.error(f"Error loading Firebase signing keys: {str(e)}")
+        signing_keys = None
+
+def verify_token_locally(id_token, project_id):
+    # Mirrors the checks done by firebase_admin.auth.verify_id_token using in-memory keys only
+    header = jwt.get_unverified_header(id_token)
+    if header.get("alg") != "RS256":
+        raise ValueError("Firebase ID token has incorrect algorithm")
+    key = signing_keys.get_key(header.get("kid"))
+    if key is None:
+        raise ValueError("Firebase ID token has no matching signing key")
+
+    decoded_token = jwt.decode(
+        id_token,
+        key,
+        algorithms=["RS256"],
+        audience=project_id,
+        issuer=f"https://securetoken.google.com/{project_id}",
+        leeway=TOKEN_CLOCK_SKEW,
+        options={"require": ["exp", "iat", "sub", "auth_time"]}
+    )
+
+    subject = decoded_token["sub"]
+    if not isinstance(subject, str) or not subject or len(subject) > 128:
+        raise ValueError("Firebase ID token has invalid subject")
+    if decoded_token["auth_time"] > time.time() + TOKEN_CLOCK_SKEW:
+        raise ValueError("Firebase ID token has auth_time in the future")
+
+    decoded_token["uid"] = subject
+    return decoded_token
+
+def token_cache_key(id_token):
+    return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+def get_token_cache_stats():
+    with token_cache_lock:
+        total = token_cache_stats["hits"] + token_cache_stats["misses"]
+        return {
+            **token_cache_stats,
+            "size": len(token_cache),
+            "hit_rate": token_cache_stats["hits"] / total if total else 0.0
+        }
+
+def clear_token_cache():
+    with token_cache_lock:
+        token_cache.clear()
+        token_cache_stats["hits"] = 0
+        token_cache_stats["misses"] = 0
+
+def verify_token(id_token, check_revoked=False):
+    # Revocation-sensitive callers always go to Firebase and never use the cache
+    use_cache = TOKEN_CACHE_ENABLED and not check_revoked
+    key = token_cache_key(id_token)
+
+    if use_cache:
+        with token_cache_lock:
+            decoded_token = token_cache.get(key)
+            if decoded_token is not None:
+                token_cache_stats["hits"] += 1
+                return decoded_token
+            token_cache_stats["misses"] += 1
+
     try:
-        # Verify the ID token
-        decoded_token = auth.verify_id_token(id_token)
-        return decoded_token
+        # Verify the ID token, locally against the in-memory key set when it is loaded
+        if signing_keys is not None and signing_keys.is_ready() and not check_revoked:
+            decoded_token = verify_token_locally(id_token, firebase_admin.get_app().project_id)
+        else:
+            decoded_token = auth.verify_id_token(id_token, check_revoked=check_revoked)
     except Exception as e:
         print(f"Error verifying token: {e}")
         return None
+
+    if TOKEN_CACHE_ENABLED and decoded_token.get("exp", 0) > time.time():
+        with token_cache_lock:
+            token_cache[key] = decoded_token
+    return decoded_token
+
+def benchmark(iterations, project_id="benchmark"):
+    # Per-call time of verify_token on a cache miss against a cache hit, using a generated key pair
+    # served by a fake key source, so neither path touches the network
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    from google.auth.credentials import AnonymousCredentials
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "benchmark")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(private_key, hashes.SHA256())
+    )
+    pem = certificate.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+
+    class BenchmarkCredential(credentials.Base):
+        def get_credential(self):
+            return AnonymousCredentials()
+
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(BenchmarkCredential(), {"projectId": project_id})
+    start_signing_key_manager(lambda: ({"benchmark": pem}, 3600))
+
+    issued_at = int(time.time())
+    token = jwt.encode(
+        {
+            "iss": f"https://securetoken.google.com/{firebase_admin.get_app().project_id}",
+            "aud": firebase_admin.get_app().project_id,
+            "sub": "benchmark-user",
+            "iat": issued_at,
+            "auth_time": issued_at,
+            "exp": issued_at + 3600
+        },
+        private_key,
+        algorithm="RS256",
+        headers={"kid": "benchmark"}
+    )
+
+    timings = {}
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        clear_token_cache()
+        if verify_token(token) is None:
+            raise RuntimeError("Benchmark token failed verification")
+    timings["uncached"] = (time.perf_counter() - started_at) / iterations
+
+    verify_token(token)
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        verify_token(token)
+    timings["cached"] = (time.perf_counter() - started_at) / iterations
+
+    stop_signing_key_manager()
+    return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare cached and uncached Firebase token verification")
+    parser.add_argument("--iterations", type=int, default=2000, help="verifications per mode")
+    args = parser.parse_args()
+
+    timings = benchmark(args.iterations)
+    print(f"uncached: {timings['uncached'] * 1e6:.1f}us per token, cached: {timings['cached'] * 1e6:.1f}us per token, "
+          f"{timings['uncached'] / timings['cached']:.0f}x faster")
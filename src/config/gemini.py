@@ -1,32 +1,284 @@
 import google.generativeai as genai
 import os
+import asyncio
+import threading
+import hashlib
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from src.service.response_cache import get_cached_response, cache_response, bypass_cache
+from src.service.context_documents import get_context_document
+from src.config.lifecycle import register_shutdown
+from src.config.async_mongodb import run_blocking
 
 load_dotenv()
 
 genai.configure(api_key=os.environ["GEMINI_API_KEY"])
 model = genai.GenerativeModel("gemini-pro")
 
+# Concurrency settings for upstream Gemini calls
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "10"))  # seconds a call may wait for a slot
 
-async def respond_to_message(message, first_message=False):
+# Dedicated pool so blocking SDK calls never run on the server's event loop, which every
+# async view in the worker shares
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+register_shutdown(lambda: gemini_executor.shutdown(wait=True))
+gemini_stats_lock = threading.Lock()
+gemini_stats = {
+    "queued": 0,
+    "in_flight": 0,
+    "max_queue_depth": 0,
+    "completed": 0,
+    "failed": 0,
+    "queue_timeouts": 0,
+    "coalesced": 0,
+    "generations": 0,
+    "prompt_tokens": 0,
+    "generation_ms": 0
+}
+
+# Upstream calls currently in flight in this worker process, keyed by prompt fingerprint. Identical
+# prompts handled by different workers are not coalesced; the response cache absorbs repeats once
+# the first of them finishes.
+inflight_calls = {}
+inflight_lock = threading.Lock()
+
+class GeminiBusyError(Exception):
+    pass
+
+def set_model(new_model):
+    # Swap in any object with generate_content(prompt) -> object with .text, e.g. a local fake for load tests
+    global model
+    previous_model = model
+    model = new_model
+    return previous_model
+
+def get_gemini_stats():
+    with gemini_stats_lock:
+        return {**gemini_stats, "max_concurrency": GEMINI_MAX_CONCURRENCY}
+
+def run_tracked(fn, *args):
+    with gemini_stats_lock:
+        gemini_stats["queued"] -= 1
+        gemini_stats["in_flight"] += 1
+    try:
+        result = fn(*args)
+        with gemini_stats_lock:
+            gemini_stats["completed"] += 1
+        return result
+    except Exception:
+        with gemini_stats_lock:
+            gemini_stats["failed"] += 1
+        raise
+    finally:
+        with gemini_stats_lock:
+            gemini_stats["in_flight"] -= 1
+
+def submit_to_gemini_pool(fn, *args):
+    with gemini_stats_lock:
+        gemini_stats["queued"] += 1
+        gemini_stats["max_queue_depth"] = max(gemini_stats["max_queue_depth"], gemini_stats["queued"])
+    return gemini_executor.submit(run_tracked, fn, *args)
+
+def cancel_queued(future):
+    # Only succeeds while the call is still waiting for a slot
+    if not future.cancel():
+        return False
+    with gemini_stats_lock:
+        gemini_stats["queued"] -= 1
+        gemini_stats["queue_timeouts"] += 1
+    return True
+
+def generate_text(prompt):
+    # Runs once per upstream call, so coalesced callers are not counted again
+    started_at = time.perf_counter()
+    response = model.generate_content(prompt)
+    record_prompt(prompt, time.perf_counter() - started_at)
+    return response.text
+
+def prompt_fingerprint(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+def submit_single_flight(prompt):
+    # Concurrent callers with an identical prompt in this process share one upstream call
+    fingerprint = prompt_fingerprint(prompt)
+    with inflight_lock:
+        future = inflight_calls.get(fingerprint)
+        if future is not None:
+            with gemini_stats_lock:
+                gemini_stats["coalesced"] += 1
+            return future, False
+        future = submit_to_gemini_pool(generate_text, prompt)
+        inflight_calls[fingerprint] = future
+
+    def forget(done_future):
+        with inflight_lock:
+            if inflight_calls.get(fingerprint) is done_future:
+                del inflight_calls[fingerprint]
+
+    future.add_done_callback(forget)
+    return future, True
+
+async def generate_async(prompt):
+    future, is_leader = submit_single_flight(prompt)
+    result = asyncio.wrap_future(future)
+    try:
+        if not is_leader:
+            # Followers wait on the leader, whose own timeout bounds queueing
+            return await result
+        return await asyncio.wait_for(asyncio.shield(result), timeout=GEMINI_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        if cancel_queued(future):
+            raise GeminiBusyError("Too many concurrent Gemini requests, please try again later")
+        # Already running, the timeout only bounds queueing time
+        return await result
+    except asyncio.CancelledError:
+        # The shared call was cancelled while queued by its leader
+        if future.cancelled():
+            raise GeminiBusyError("Too many concurrent Gemini requests, please try again later")
+        raise
+
+# Marks the end of a streamed response on the chunk queue
+STREAM_END = object()
+
+def stream_into(prompt, chunks, started):
+    started.set()
+    started_at = time.perf_counter()
+    try:
+        for chunk in model.generate_content(prompt, stream=True):
+            if chunk.text:
+                chunks.put(chunk.text)
+        record_prompt(prompt, time.perf_counter() - started_at)
+        chunks.put(STREAM_END)
+    except Exception as e:
+        chunks.put(e)
+        raise
+
+async def stream_text(prompt):
+    # Waits for a pool slot up front so a busy pool surfaces before any bytes are sent; the wait
+    # happens off the event loop, the returned iterator is consumed by the request thread
+    chunks = queue.Queue()
+    started = threading.Event()
+    future = submit_to_gemini_pool(stream_into, prompt, chunks, started)
+    if not await asyncio.to_thread(started.wait, GEMINI_QUEUE_TIMEOUT) and cancel_queued(future):
+        raise GeminiBusyError("Too many concurrent Gemini requests, please try again later")
+
+    def relay():
+        while True:
+            item = chunks.get()
+            if item is STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    return relay()
+
+
+def build_prompt(message, first_message=False, document=None, history=None, knowledge=None):
+    history_text = f"{history['text']}\n\n" if history else ""
+    knowledge_text = f"Relevant notes from the child's knowledge base:\n{knowledge['text']}\n\n" if knowledge else ""
     if first_message:
         context = "You are a clinical psychologist with expertise in child development and behavioral health. You often conduct assessments, diagnose ASD, and provide therapy to help manage symptoms. You also help guide parents, teachers, and support workers on how to best interact with children with ASD. You are passionate about helping mothers and fathers understand their child's unique needs and strengths."
         instruction = "You will be given short questions coming from guardians, teachers, and support workers of the children with ASD. You must respond emphatetically and provide guidance on how to best interact with the child given a specific scenario. You also keep a document that contains your previous diagnoses of the child's current condition and the progress of the therapy. What follows is the specified document:"
-        with open("diagnosis.md", "r", encoding="utf-8") as file:
-            document = file.read()
+        # Retrieved chunks replace the full document when there are any
+        document_text = knowledge["text"] if knowledge else (document["content"] if document else "")
         output = f"You are to answer the following question as if you are in a consultation with the mother of the child. Ensure that your answer is concise, easy to understand with as little jargon as possible, and actionable. The question is: {message}"
-        prompt = f"""{context}\n\n{instruction}\n\n{document}\n\n{output}"""
+        prompt = f"""{context}\n\n{instruction}\n\n{document_text}\n\n{history_text}{output}"""
     else:
         prompt = f"""You are a clinical psychologist with expertise in child development and behavioral health, 
         specializing in ASD (Autism Spectrum Disorder). Respond to the following question from a parent or caregiver 
         of a child with ASD. Be empathetic, clear, and provide actionable guidance.
 
-        Question: {message}"""
+        {knowledge_text}{history_text}Question: {message}"""
+    return prompt
+
+def estimate_tokens(text):
+    # Roughly four characters per token, good enough for budgeting without an API call
+    return (len(text) + 3) // 4
+
+def record_prompt(prompt, elapsed):
+    tokens = estimate_tokens(prompt)
+    with gemini_stats_lock:
+        gemini_stats["generations"] += 1
+        gemini_stats["prompt_tokens"] += tokens
+        gemini_stats["generation_ms"] += int(elapsed * 1000)
+    logging.info(f"Gemini prompt ~{tokens} tokens, generated in {elapsed * 1000:.0f}ms")
+
+def load_context(first_message=False, child_id=None, knowledge=None):
+    # Only the first-message prompt embeds the diagnosis document, and only without retrieved chunks
+    if not first_message or knowledge:
+        return None
+    return get_context_document(child_id)
+
+def prompt_version(document=None, knowledge=None):
+    # Everything besides the question that changes a cacheable prompt, for the response cache key
+    parts = [
+        document["version"] if document else None,
+        knowledge["version"] if knowledge else None
+    ]
+    if not any(parts):
+        return None
+    return ":".join(part or "" for part in parts)
+
+def uses_response_cache(use_cache, history=None):
+    # The conversation history changes with every turn, so a prompt that carries it is never asked
+    # twice; those lookups could only miss and their entries would evict reusable answers
+    if use_cache and history:
+        bypass_cache()
+        return False
+    return use_cache
+
+async def stream_message(message, first_message=False, use_cache=True, child_id=None, history=None, knowledge=None):
+    document = await run_blocking(load_context, first_message, child_id, knowledge)
+    version = prompt_version(document, knowledge)
+    use_cache = uses_response_cache(use_cache, history)
+    if use_cache:
+        cached = await run_blocking(get_cached_response, message, first_message, version)
+        if cached is not None:
+            return iter([cached])
+
+    prompt = build_prompt(message, first_message, document, history, knowledge)
+    chunks = await stream_text(prompt)
+
+    def relay():
+        response_parts = []
+        for text in chunks:
+            response_parts.append(text)
+            yield text
+        if use_cache:
+            cache_response(message, "".join(response_parts), first_message, version)
+
+    return relay()
+
+async def respond_to_message(message, first_message=False, use_cache=True, child_id=None, history=None, knowledge=None,
+                             fallback=True):
+    # Async views share the worker's event loop, so blocking lookups run on the I/O pool
+    document = await run_blocking(load_context, first_message, child_id, knowledge)
+    version = prompt_version(document, knowledge)
+    use_cache = uses_response_cache(use_cache, history)
+    if use_cache:
+        cached = await run_blocking(get_cached_response, message, first_message, version)
+        if cached is not None:
+            return cached
+
+    prompt = build_prompt(message, first_message, document, history, knowledge)
 
     try:
-        # Generate response using the model
-        response = model.generate_content(prompt)
-        return response.text
+        # Generate response using the model without blocking the event loop
+        response = await generate_async(prompt)
+    except GeminiBusyError:
+        raise
     except Exception as e:
         print(f"Error generating response: {str(e)}")
+        # Callers that retry on their own want the error instead of the apology text
+        if not fallback:
+            raise
         return "I apologize, but I'm having trouble generating a response at the moment. Please try again later."
+
+    if use_cache:
+        await run_blocking(cache_response, message, response, first_message, version)
+    return response
@@ -0,0 +1,115 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from bson import ObjectId
+from src.config.mongodb import get_db
+import argparse
+import logging
+
+# Indexes required by the controllers, keyed by collection
+INDEXES = {
+    "child": [
+        {"keys": [("parent_uid", ASCENDING)]},
+        {"keys": [("support_code", ASCENDING)], "unique": True},
+        {"keys": [("support_group_id", ASCENDING)]}
+    ],
+    "support_group": [
+        {"keys": [("members.uid", ASCENDING)]}
+    ],
+    "support_group_members": [
+        {"keys": [("support_group_id", ASCENDING), ("uid", ASCENDING)], "unique": True},
+        {"keys": [("support_group_id", ASCENDING), ("joined_at", ASCENDING), ("_id", ASCENDING)]},
+        {"keys": [("uid", ASCENDING)]}
+    ],
+    "chat": [
+        {"keys": [("child_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]}
+    ],
+    "knowledge_base_chunks": [
+        {"keys": [("child_id", ASCENDING), ("key", ASCENDING), ("position", ASCENDING)]}
+    ],
+    "knowledge_base_files": [
+        {"keys": [("key", ASCENDING)], "unique": True},
+        {"keys": [("child_id", ASCENDING), ("uploaded_at", DESCENDING), ("_id", DESCENDING)]},
+        {"keys": [("child_id", ASCENDING), ("content_type", ASCENDING), ("uploaded_at", DESCENDING), ("_id", DESCENDING)]},
+        {"keys": [("child_id", ASCENDING)], "unique": True, "partialFilterExpression": {"is_diagnosis": True},
+         "name": "child_id_diagnosis"}
+    ],
+    "signed_urls": [
+        {"keys": [("refresh_at", ASCENDING)], "expireAfterSeconds": 0},
+        {"keys": [("key", ASCENDING)]}
+    ],
+    "chat_response_cache": [
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+        {"keys": [("last_hit_at", ASCENDING)]}
+    ]
+}
+
+# Representative queries issued by the controllers, used to check for collection scans
+SAMPLE_QUERIES = [
+    ("child", {"parent_uid": "uid"}, None),
+    ("child", {"support_code": "000000"}, None),
+    ("child", {"support_group_id": "group", "parent_uid": {"$ne": "uid"}}, None),
+    ("child", {"_id": ObjectId(), "parent_uid": "uid"}, None),
+    ("support_group", {"members.uid": "uid"}, None),
+    ("support_group", {"_id": ObjectId(), "members.uid": "uid"}, None),
+    ("support_group_members", {"support_group_id": "group", "uid": "uid"}, None),
+    ("support_group_members", {"support_group_id": "group"}, [("joined_at", ASCENDING), ("_id", ASCENDING)]),
+    ("support_group_members", {"uid": "uid"}, None),
+    ("chat", {"child_id": ObjectId()}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("knowledge_base_chunks", {"child_id": "child"}, [("key", ASCENDING), ("position", ASCENDING)]),
+    ("knowledge_base_files", {"child_id": "child"}, [("uploaded_at", DESCENDING), ("_id", DESCENDING)]),
+    ("knowledge_base_files", {"child_id": "child", "content_type": "application/pdf"},
+     [("uploaded_at", DESCENDING), ("_id", DESCENDING)]),
+    ("knowledge_base_files", {"child_id": "child", "is_diagnosis": True}, None)
+]
+
+def ensure_indexes(database=None):
+    # create_index is a no-op when an identical index already exists
+    database = database if database is not None else get_db()
+    created = []
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            options = {key: value for key, value in index.items() if key != "keys"}
+            try:
+                name = database[collection_name].create_index(index["keys"], **options)
+                created.append(f"{collection_name}.{name}")
+            except OperationFailure as e:
+                # e.g. existing duplicate support codes block the unique index
+                logging.error(f"Error creating index on {collection_name} {index['keys']}: {str(e)}")
+    logging.info(f"Ensured indexes: {', '.join(created)}")
+    return created
+
+def plan_stages(plan):
+    stages = [plan.get("stage")]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages.extend(plan_stages(child))
+    return stages
+
+def find_collection_scans(database=None):
+    # Returns the sample queries whose winning plan still scans the whole collection
+    database = database if database is not None else get_db()
+    scans = []
+    for collection_name, query, sort in SAMPLE_QUERIES:
+        cursor = database[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        # Plans from the slot-based engine nest the classic plan under queryPlan
+        stages = plan_stages(plan.get("queryPlan", plan))
+        if "COLLSCAN" in stages:
+            scans.append({"collection": collection_name, "query": str(query), "stages": stages})
+    return scans
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create the MongoDB indexes used by the API")
+    parser.add_argument("--explain", action="store_true", help="report queries that fall back to collection scans")
+    args = parser.parse_args()
+
+    for name in ensure_indexes():
+        print(f"ok {name}")
+    if args.explain:
+        scans = find_collection_scans()
+        for scan in scans:
+            print(f"COLLSCAN {scan['collection']} {scan['query']} {' -> '.join(scan['stages'])}")
+        if not scans:
+            print("All sample queries use an index")
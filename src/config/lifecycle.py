@@ -0,0 +1,94 @@
+from src.config.firebase import initialize_firebase, stop_signing_key_manager
+from src.config.indexes import ensure_indexes
+from src.config.mongodb import close_client
+from src.config.storage import drain_uploads, close_s3_client
+from dotenv import load_dotenv
+import threading
+import asyncio
+import logging
+import os
+
+load_dotenv()
+
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "true").lower() == "true"
+
+# Process that owns the current set of clients, so init runs once per worker after fork or spawn
+worker_pid = None
+worker_lock = threading.Lock()
+startup_callbacks = []
+shutdown_callbacks = []
+
+# uvicorn's event loop for this worker, where async views run
+server_loop = None
+
+def register_startup(callback):
+    # Callbacks run in registration order once the worker's clients are ready
+    startup_callbacks.append(callback)
+    return callback
+
+def register_shutdown(callback):
+    # Callbacks run in reverse registration order when the worker drains
+    shutdown_callbacks.append(callback)
+    return callback
+
+def get_server_loop():
+    return server_loop
+
+def init_worker():
+    global worker_pid
+    if worker_pid == os.getpid():
+        return
+    with worker_lock:
+        if worker_pid == os.getpid():
+            return
+        initialize_firebase()
+        if ENSURE_INDEXES:
+            try:
+                ensure_indexes()
+            except Exception as e:
+                # Do not block startup on MongoDB, /api/ready reports it instead
+                logging.error(f"Error ensuring MongoDB indexes: {str(e)}")
+        for callback in startup_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error during worker startup: {str(e)}")
+        worker_pid = os.getpid()
+        logging.info(f"Initialized worker {worker_pid}")
+
+def shutdown_worker():
+    for callback in reversed(shutdown_callbacks):
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Error during worker shutdown: {str(e)}")
+    stop_signing_key_manager()
+    close_client()
+    drain_uploads()
+    close_s3_client()
+    logging.info(f"Worker {os.getpid()} drained")
+
+def with_lifespan(asgi_app):
+    # Runs init_worker/shutdown_worker from the server's lifespan events in every worker process
+    async def app(scope, receive, send):
+        global server_loop
+        server_loop = asyncio.get_running_loop()
+        if scope["type"] != "lifespan":
+            await asgi_app(scope, receive, send)
+            return
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await asyncio.to_thread(init_worker)
+                    await send({"type": "lifespan.startup.complete"})
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.to_thread(shutdown_worker)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    return app
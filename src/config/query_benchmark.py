@@ -0,0 +1,280 @@
+from src.config import mongodb
+from src.config.indexes import ensure_indexes
+from bson import ObjectId
+from datetime import datetime, timedelta
+from flask import Flask
+from dotenv import load_dotenv
+import statistics
+import inspect
+import argparse
+import time
+import io
+import os
+
+load_dotenv()
+
+# Scratch database on MONGO_URI, dropped after every run
+BENCHMARK_DB_NAME = os.getenv("BENCHMARK_DB_NAME", f"{mongodb.DB_NAME}_benchmark")
+
+def timed(fn, repeat):
+    # Median wall time of `repeat` calls, in milliseconds
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(samples)
+
+def use_scratch_database():
+    # Every collection in the app resolves its database on use, so switching the name redirects them all
+    mongodb.DB_NAME = BENCHMARK_DB_NAME
+    database = mongodb.get_db()
+    mongodb.get_client().drop_database(BENCHMARK_DB_NAME)
+    ensure_indexes(database)
+    return database
+
+def seed_chats(database, child_id, count):
+    started_at = datetime.now() - timedelta(seconds=count)
+    database.chat.insert_many([
+        {
+            "child_id": child_id,
+            "question": f"Question {index} " + "q" * 200,
+            "response": f"Response {index} " + "r" * 1500,
+            "created_at": started_at + timedelta(seconds=index),
+            "status": "completed"
+        }
+        for index in range(count)
+    ])
+
+def benchmark_chats(history_sizes, limit, repeat):
+    # GET /api/chat/<child_id>: the former full-history read against the keyset-paginated view,
+    # first page and a page from the middle of the history
+    from src.controller.chat_controller import list_chats, collection
+
+    database = use_scratch_database()
+    app = Flask("benchmark")
+    results = []
+    try:
+        for count in history_sizes:
+            child_id = ObjectId()
+            seed_chats(database, child_id, count)
+
+            def full_history():
+                list(collection.find({"child_id": child_id}).sort("created_at", 1))
+
+            def page(cursor=None):
+                query = f"limit={limit}" + (f"&next={cursor}" if cursor else "")
+                with app.test_request_context(f"/api/chat/{child_id}?{query}"):
+                    response, status = list_chats(str(child_id))
+                    if status != 200:
+                        raise RuntimeError(f"list_chats failed: {response.get_json()}")
+                    return response.get_json()["next"]
+
+            # Walk to the middle of the history once to get a deep cursor
+            cursor = None
+            for _ in range(count // limit // 2):
+                cursor = page(cursor)
+
+            results.append({
+                "chats": count,
+                "full_history_ms": timed(full_history, repeat),
+                "first_page_ms": timed(page, repeat),
+                "middle_page_ms": timed(lambda: page(cursor), repeat)
+            })
+    finally:
+        mongodb.get_client().drop_database(BENCHMARK_DB_NAME)
+    return results
+
+def seed_groups(database, uid, group_count, children_per_group, members_per_group):
+    for group_index in range(group_count):
+        members = [
+            {"uid": f"member-{group_index}-{index}", "name": "Member", "role": "none", "joined_at": datetime.utcnow()}
+            for index in range(members_per_group)
+        ]
+        members.append({"uid": uid, "name": "Benchmark user", "role": "viewer", "joined_at": datetime.utcnow()})
+        group_id = str(database.support_group.insert_one({"name": f"Group {group_index}", "members": members}).inserted_id)
+        database.child.insert_many([
+            {
+                "name": f"Child {group_index}-{index}",
+                "parent_uid": f"parent-{group_index}",
+                "support_group_id": group_id,
+                "support_code": f"{uid}-{group_index}-{index}"
+            }
+            for index in range(children_per_group)
+        ])
+
+def legacy_children(database, uid):
+    # The former GET /api/child: one child query per support group and a member scan per child
+    children = list(database.child.find({"parent_uid": uid}))
+    for group in database.support_group.find({"members.uid": uid}):
+        group_id = str(group["_id"])
+        for child in database.child.find({"support_group_id": group_id, "parent_uid": {"$ne": uid}}):
+            child["support_group_role"] = next(
+                (member["role"] for member in group["members"] if member["uid"] == uid),
+                "member"
+            )
+            children.append(child)
+    return children
+
+def benchmark_children(group_counts, children_per_group, members_per_group, repeat):
+    # GET /api/child: the former per-group query loop against the current two-query view
+    from src.controller.child_controller import get_all_children
+    from flask import request
+
+    database = use_scratch_database()
+    app = Flask("benchmark")
+    view = get_all_children.__wrapped__  # skips token verification
+    results = []
+    try:
+        for group_count in group_counts:
+            uid = f"benchmark-{group_count}"
+            seed_groups(database, uid, group_count, children_per_group, members_per_group)
+
+            def current():
+                with app.test_request_context("/api/child"):
+                    request.user = {"uid": uid}
+                    response, status = view()
+                    if status != 200:
+                        raise RuntimeError(f"get_all_children failed: {response.get_json()}")
+
+            results.append({
+                "groups": group_count,
+                "legacy_ms": timed(lambda: legacy_children(database, uid), repeat),
+                "current_ms": timed(current, repeat)
+            })
+    finally:
+        mongodb.get_client().drop_database(BENCHMARK_DB_NAME)
+    return results
+
+class Delayed:
+    # Local stand-in with a fixed round trip: every call on the wrapped object sleeps `latency` seconds
+    # first. Items and attributes that are not methods are wrapped too, so client[db][collection] works.
+    def __init__(self, target, latency):
+        self.target = target
+        self.latency = latency
+
+    def __getitem__(self, name):
+        return Delayed(self.target[name], self.latency)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not inspect.isroutine(attribute):
+            return Delayed(attribute, self.latency)
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return attribute(*args, **kwargs)
+        return call
+
+class StandInS3Client:
+    # The calls create_child makes, each costing one round trip
+    def __init__(self, latency):
+        self.latency = latency
+
+    def put_object(self, **params):
+        time.sleep(self.latency)
+
+    def upload_fileobj(self, file, bucket, key, **params):
+        file.read()
+        time.sleep(self.latency)
+
+    def delete_objects(self, **params):
+        time.sleep(self.latency)
+
+def legacy_create_child(database, s3_client, uid, payloads):
+    # The former POST /api/child: group insert, child insert and group update one after another,
+    # then the folder marker and one upload per file
+    now = datetime.now()
+    support_code = str(ObjectId())
+    group_id = database.support_group.insert_one({
+        "code": support_code, "name": "Support group", "child_id": None,
+        "members": [{"uid": uid, "name": "Parent", "role": "parent", "joined_at": now}],
+        "created_at": now, "updated_at": now
+    }).inserted_id
+    child_id = str(database.child.insert_one({
+        "name": "Child", "parent_uid": uid, "support_group_id": str(group_id), "support_code": support_code,
+        "created_at": now, "updated_at": now
+    }).inserted_id)
+    database.support_group.update_one({"_id": group_id}, {"$set": {"child_id": child_id}})
+    s3_client.put_object(Key=f"{child_id}/")
+    for index, payload in enumerate(payloads):
+        s3_client.upload_fileobj(io.BytesIO(payload), None, f"{child_id}/{index}.png")
+
+def benchmark_create_child(runs, file_count, file_size, mongo_latency, s3_latency):
+    # POST /api/child against mongomock and an S3 stand-in with fixed round trips, the former
+    # sequential flow against the current one; returns p50 and p99 in milliseconds for both
+    from src.config import storage
+    from src.controller.child_controller import create_child
+    from flask import request
+    import mongomock
+
+    database = Delayed(mongomock.MongoClient(), mongo_latency)
+    get_client = mongodb.get_client
+    mongodb.get_client = lambda: database
+    ensure_indexes(mongodb.get_db())
+    s3_client = StandInS3Client(s3_latency)
+    previous_s3_client = storage.set_s3_client(s3_client)
+
+    app = Flask("benchmark")
+    view = create_child.__wrapped__  # skips token verification
+    payloads = [os.urandom(file_size) for _ in range(file_count)]
+    form = {"name": "Child", "birthday": "2020-01-01", "sex": "F", "asd_type": "1"}
+
+    def current():
+        data = {**form, "files": [(io.BytesIO(payload), f"{index}.png", "image/png") for index, payload in enumerate(payloads)]}
+        with app.test_request_context("/api/child", method="POST", data=data, content_type="multipart/form-data"):
+            request.user = {"uid": "benchmark", "name": "Parent"}
+            response, status = view()
+            if status != 201:
+                raise RuntimeError(f"create_child failed: {response.get_json()}")
+
+    def percentiles(fn):
+        samples = []
+        for _ in range(runs):
+            started_at = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started_at) * 1000)
+        cuts = statistics.quantiles(samples, n=100)
+        return {"p50_ms": cuts[49], "p99_ms": cuts[98]}
+
+    try:
+        return {
+            "sequential": percentiles(lambda: legacy_create_child(mongodb.get_db(), s3_client, "benchmark", payloads)),
+            "current": percentiles(current)
+        }
+    finally:
+        mongodb.get_client = get_client
+        storage.set_s3_client(previous_s3_client)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time chat history and child listing queries against a seeded scratch database, "
+                                                 "and child creation against local stand-ins")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    chats = subparsers.add_parser("chats", help="full chat history against keyset pages")
+    chats.add_argument("--history", type=int, nargs="+", default=[100, 1000, 10000], help="chats per child")
+    chats.add_argument("--limit", type=int, default=50, help="page size")
+    children = subparsers.add_parser("children", help="per-group child queries against the two-query listing")
+    children.add_argument("--groups", type=int, nargs="+", default=[1, 10, 50, 200], help="support groups per user")
+    children.add_argument("--children", type=int, default=2, help="children per support group")
+    children.add_argument("--members", type=int, default=20, help="other members per support group")
+    create = subparsers.add_parser("create-child", help="sequential against overlapped child creation, no external services")
+    create.add_argument("--runs", type=int, default=200, help="children created per flow")
+    create.add_argument("--files", type=int, default=3, help="files uploaded with every child")
+    create.add_argument("--size", type=int, default=64 * 1024, help="bytes per file")
+    create.add_argument("--mongo-latency", type=float, default=0.002, help="seconds per MongoDB call")
+    create.add_argument("--s3-latency", type=float, default=0.02, help="seconds per S3 call")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per measurement, the median is reported")
+    args = parser.parse_args()
+
+    if args.benchmark == "chats":
+        for result in benchmark_chats(args.history, args.limit, args.repeat):
+            print(f"{result['chats']} chats: full history {result['full_history_ms']:.1f}ms, "
+                  f"first page {result['first_page_ms']:.1f}ms, middle page {result['middle_page_ms']:.1f}ms")
+    elif args.benchmark == "create-child":
+        results = benchmark_create_child(args.runs, args.files, args.size, args.mongo_latency, args.s3_latency)
+        for name, result in results.items():
+            print(f"{name}: p50 {result['p50_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms")
+    else:
+        for result in benchmark_children(args.groups, args.children, args.members, args.repeat):
+            print(f"{result['groups']} groups: per-group queries {result['legacy_ms']:.1f}ms, "
+                  f"two queries {result['current_ms']:.1f}ms")
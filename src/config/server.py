@@ -0,0 +1,268 @@
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from src.config.lifecycle import register_shutdown, with_lifespan
+from concurrent.futures import ProcessPoolExecutor
+import http.client
+import subprocess
+import argparse
+import asyncio
+import socket
+import time
+import sys
+import os
+
+load_dotenv()
+
+# Requests handled at once by one worker process
+WEB_THREADS = int(os.getenv("WEB_THREADS", "32"))
+
+# WsgiToAsgi runs the WSGI app through a thread-sensitive sync_to_async, which funnels every request
+# of a worker through one thread, so a worker serves a single request at a time. Requests here run on
+# a bounded pool instead; async views still run on the server's event loop through AsyncToSync.
+request_executor = ThreadPoolExecutor(max_workers=WEB_THREADS, thread_name_prefix="request")
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self.run_wsgi, thread_sensitive=False, executor=request_executor)(body)
+
+    def run_wsgi(self, body):
+        # Runs on a request thread, so start_response is called on the thread that iterates the response
+        environ = self.build_environ(self.scope, body)
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            bytes_sent = 0
+            for output in response:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # Never send more than the Content-Length the application declared
+                if self.response_content_length is not None:
+                    output = output[:self.response_content_length - bytes_sent]
+                self.sync_send({"type": "http.response.body", "body": output, "more_body": True})
+                bytes_sent += len(output)
+                if bytes_sent == self.response_content_length:
+                    break
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({"type": "http.response.body"})
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+@register_shutdown
+def drain_requests():
+    request_executor.shutdown(wait=True)
+
+async def call_asgi(asgi_app, path):
+    scope = {
+        "type": "http", "method": "GET", "path": path, "raw_path": path.encode("ascii"), "query_string": b"",
+        "headers": [], "http_version": "1.1", "scheme": "http", "server": ("benchmark", 80),
+        "client": ("benchmark", 0), "root_path": ""
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await asgi_app(scope, receive, send)
+
+def benchmark(concurrency, delay):
+    # Wall time of `concurrency` simultaneous requests to views that wait `delay` seconds,
+    # through the stock adapter and the threaded one, without any network in between
+    from flask import Flask
+
+    app = Flask("benchmark")
+
+    @app.route("/async")
+    async def async_view():
+        await asyncio.sleep(delay)
+        return "ok"
+
+    @app.route("/sync")
+    def sync_view():
+        time.sleep(delay)
+        return "ok"
+
+    async def run(asgi_app, path):
+        started_at = time.perf_counter()
+        await asyncio.gather(*[call_asgi(asgi_app, path) for _ in range(concurrency)])
+        return time.perf_counter() - started_at
+
+    timings = {}
+    for name, asgi_app in (("WsgiToAsgi", WsgiToAsgi(app)), ("ThreadedWsgiToAsgi", ThreadedWsgiToAsgi(app))):
+        for path in ("/async", "/sync"):
+            timings[f"{name} {path}"] = asyncio.run(run(asgi_app, path))
+    return timings
+
+def benchmark_mongo(concurrency, reads, repeat):
+    # Wall time of `concurrency` simultaneous requests that each read `reads` chats from MongoDB: a sync
+    # view on the blocking driver, an async view awaiting the async layer, and an async view handing the
+    # blocking driver to run_blocking. Seeds and drops the scratch database query_benchmark uses.
+    from src.config import async_mongodb, mongodb
+    from src.config.async_mongodb import AsyncCollection, run_blocking
+    from src.config.query_benchmark import BENCHMARK_DB_NAME, use_scratch_database, seed_chats
+    from bson import ObjectId
+    from flask import Flask
+
+    database = use_scratch_database()
+    async_mongodb.DB_NAME = BENCHMARK_DB_NAME
+    child_id = ObjectId()
+    seed_chats(database, child_id, 100)
+    sync_collection = mongodb.get_collection('chat')
+    async_collection = AsyncCollection('chat')
+
+    def read_sync():
+        for _ in range(reads):
+            sync_collection.find_one({"child_id": child_id}, sort=[("created_at", -1)])
+
+    app = Flask("benchmark")
+
+    @app.route("/sync")
+    def sync_view():
+        read_sync()
+        return "ok"
+
+    @app.route("/async")
+    async def async_view():
+        for _ in range(reads):
+            await async_collection.find_one({"child_id": child_id}, sort=[("created_at", -1)])
+        return "ok"
+
+    @app.route("/run_blocking")
+    async def run_blocking_view():
+        await run_blocking(read_sync)
+        return "ok"
+
+    # The lifespan wrapper makes the benchmark loop the server loop, so the async client runs on it
+    # as it does under uvicorn
+    asgi_app = with_lifespan(ThreadedWsgiToAsgi(app))
+
+    async def run():
+        timings = {}
+        for path in ("/sync", "/async", "/run_blocking"):
+            await call_asgi(asgi_app, path)  # warm up connections
+            samples = []
+            for _ in range(repeat):
+                started_at = time.perf_counter()
+                await asyncio.gather(*[call_asgi(asgi_app, path) for _ in range(concurrency)])
+                samples.append(time.perf_counter() - started_at)
+            timings[path] = sorted(samples)[len(samples) // 2]
+        return timings
+
+    try:
+        return asyncio.run(run())
+    finally:
+        mongodb.get_client().drop_database(BENCHMARK_DB_NAME)
+
+def create_benchmark_app():
+    # uvicorn factory for the worker benchmark: one view that builds and serializes a page of chats,
+    # CPU work that holds the GIL like most of a real request outside I/O
+    from flask import Flask, jsonify
+
+    page_size = int(os.getenv("BENCHMARK_PAGE_SIZE", "200"))
+    app = Flask("benchmark")
+
+    @app.route("/page")
+    def page_view():
+        chats = [
+            {"_id": f"{index:024x}", "question": f"Question {index} " + "q" * 200, "response": "r" * 1500, "status": "completed"}
+            for index in range(page_size)
+        ]
+        return jsonify({"chats": chats, "next": None})
+
+    return ThreadedWsgiToAsgi(app)
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def wait_until_serving(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/page")
+            if connection.getresponse().status == 200:
+                connection.close()
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Benchmark server on port {port} did not start")
+
+def load(port, duration):
+    # One keep-alive connection issuing requests back to back; returns the completed count
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    completed = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        connection.request("GET", "/page")
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Benchmark request failed with {response.status}")
+        completed += 1
+    connection.close()
+    return completed
+
+def benchmark_workers(worker_counts, clients, duration, page_size):
+    # Requests per second of uvicorn with each worker count, loaded by `clients` processes. The load
+    # generator shares the machine, so scaling flattens once workers and clients exceed the cores.
+    results = []
+    for workers in worker_counts:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.config.server:create_benchmark_app", "--factory",
+             "--workers", str(workers), "--port", str(port), "--log-level", "warning"],
+            env={**os.environ, "BENCHMARK_PAGE_SIZE": str(page_size)}
+        )
+        try:
+            wait_until_serving(port)
+            with ProcessPoolExecutor(max_workers=clients) as executor:
+                completed = sum(executor.map(load, [port] * clients, [duration] * clients))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        results.append({"workers": workers, "requests_per_second": completed / duration})
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure request concurrency and throughput of the ASGI server setup")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    adapters = subparsers.add_parser("adapters", help="simultaneous requests through both ASGI adapters in one worker")
+    adapters.add_argument("--concurrency", type=int, default=8, help="simultaneous requests")
+    adapters.add_argument("--delay", type=float, default=0.5, help="seconds each view waits")
+    mongo = subparsers.add_parser("mongo", help="simultaneous MongoDB-bound requests through the sync and async drivers")
+    mongo.add_argument("--concurrency", type=int, default=64, help="simultaneous requests")
+    mongo.add_argument("--reads", type=int, default=5, help="sequential reads per request")
+    mongo.add_argument("--repeat", type=int, default=5, help="timed runs per view, the median is reported")
+    workers = subparsers.add_parser("workers", help="requests per second as uvicorn workers are added")
+    workers.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}),
+                         help="worker counts to compare")
+    workers.add_argument("--clients", type=int, default=os.cpu_count() or 1, help="load generator processes")
+    workers.add_argument("--duration", type=float, default=10, help="seconds of load per worker count")
+    workers.add_argument("--page-size", type=int, default=200, help="chats serialized per request")
+    args = parser.parse_args()
+
+    if args.benchmark == "adapters":
+        for name, elapsed in benchmark(args.concurrency, args.delay).items():
+            print(f"{name}: {elapsed:.2f}s, {args.concurrency / elapsed:.1f} requests/s")
+    elif args.benchmark == "mongo":
+        for path, elapsed in benchmark_mongo(args.concurrency, args.reads, args.repeat).items():
+            print(f"{path}: {elapsed:.2f}s, {args.concurrency / elapsed:.1f} requests/s")
+    else:
+        print(f"{os.cpu_count()} cores")
+        results = benchmark_workers(args.workers, args.clients, args.duration, args.page_size)
+        for result in results:
+            print(f"{result['workers']} workers: {result['requests_per_second']:.1f} requests/s, "
+                  f"{result['requests_per_second'] / results[0]['requests_per_second']:.2f}x")
@@ -0,0 +1,195 @@
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import threading
+import argparse
+import boto3
+import time
+import io
+import os
+
+load_dotenv()
+
+BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
+
+# S3 client settings
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. http://localhost:9000 for MinIO or moto_server
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+S3_TCP_KEEPALIVE = os.getenv("S3_TCP_KEEPALIVE", "true").lower() == "true"
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "adaptive")  # legacy, standard or adaptive
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "60"))
+S3_ADDRESSING_STYLE = os.getenv("S3_ADDRESSING_STYLE", "auto")  # local stand-ins usually need path
+
+# Upload settings; S3_MAX_POOL_CONNECTIONS should cover S3_UPLOAD_WORKERS * S3_TRANSFER_CONCURRENCY
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "8"))  # files uploaded at once per process
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", "4"))  # parts uploaded at once per file
+
+def client_config():
+    return Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=S3_TCP_KEEPALIVE,
+        retries={"mode": S3_RETRY_MODE, "max_attempts": S3_MAX_ATTEMPTS},
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        s3={"addressing_style": S3_ADDRESSING_STYLE}
+    )
+
+transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_TRANSFER_CONCURRENCY,
+    use_threads=S3_TRANSFER_CONCURRENCY > 1
+)
+
+# Bounded pool shared by every upload batch in the process
+upload_executor = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+
+# One client per process, created on first use; botocore clients are thread-safe and share one pool
+s3_client = None
+s3_client_pid = None
+s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    global s3_client, s3_client_pid
+    if s3_client is None or s3_client_pid != os.getpid():
+        with s3_client_lock:
+            if s3_client is None or s3_client_pid != os.getpid():
+                s3_client = boto3.session.Session().client(
+                    's3',
+                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                    region_name=os.getenv('AWS_REGION'),
+                    endpoint_url=S3_ENDPOINT_URL,
+                    config=client_config()
+                )
+                s3_client_pid = os.getpid()
+    return s3_client
+
+def set_s3_client(client):
+    # Swap in another client, e.g. one created inside moto's mock_aws for tests
+    global s3_client, s3_client_pid
+    with s3_client_lock:
+        previous_client = s3_client
+        s3_client = client
+        s3_client_pid = os.getpid()
+    return previous_client
+
+def drain_uploads():
+    upload_executor.shutdown(wait=True)
+
+def close_s3_client():
+    global s3_client, s3_client_pid
+    with s3_client_lock:
+        if s3_client is not None and s3_client_pid == os.getpid():
+            s3_client.close()
+        s3_client = None
+        s3_client_pid = None
+
+def put_object(key, body=b"", content_type=None):
+    params = {"Bucket": BUCKET_NAME, "Key": key, "Body": body}
+    if content_type:
+        params["ContentType"] = content_type
+    return get_s3_client().put_object(**params)
+
+def upload_fileobj(file, key, content_type=None):
+    extra_args = {"ContentType": content_type} if content_type else None
+    get_s3_client().upload_fileobj(file, BUCKET_NAME, key, ExtraArgs=extra_args, Config=transfer_config)
+
+def upload_batch(uploads, rollback=False):
+    # uploads is a list of {"key", "file", "content_type"}; returns one result per upload, in order.
+    # With rollback, a single failure deletes every object the batch did upload.
+    futures = [
+        upload_executor.submit(upload_fileobj, upload["file"], upload["key"], upload.get("content_type"))
+        for upload in uploads
+    ]
+    results = []
+    for upload, future in zip(uploads, futures):
+        error = future.exception()
+        results.append({"key": upload["key"], "success": error is None, "error": str(error) if error else None})
+
+    if rollback and not all(result["success"] for result in results):
+        delete_objects(result["key"] for result in results if result["success"])
+        for result in results:
+            if result["success"]:
+                result.update(success=False, rolled_back=True, error="Rolled back after another file failed")
+    return results
+
+def get_object(key, **params):
+    return get_s3_client().get_object(Bucket=BUCKET_NAME, Key=key, **params)
+
+def head_object(key):
+    return get_s3_client().head_object(Bucket=BUCKET_NAME, Key=key)
+
+def list_objects(prefix):
+    # Follows continuation tokens, so listings are not cut off at 1,000 keys
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        yield from page.get("Contents", [])
+
+def delete_object(key):
+    return get_s3_client().delete_object(Bucket=BUCKET_NAME, Key=key)
+
+def delete_objects(keys):
+    # DeleteObjects takes at most 1,000 keys per call
+    keys = list(keys)
+    for start in range(0, len(keys), 1000):
+        get_s3_client().delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True}
+        )
+
+def generate_presigned_url(key, expires_in=3600):
+    return get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': BUCKET_NAME, 'Key': key},
+        ExpiresIn=expires_in
+    )
+
+def generate_presigned_post(key, content_type, max_size, metadata=None, expires_in=900):
+    # Browser-style POST policy pinned to one key, one content type and a size range
+    fields = {"Content-Type": content_type}
+    conditions = [{"Content-Type": content_type}, ["content-length-range", 1, max_size]]
+    for name, value in (metadata or {}).items():
+        fields[f"x-amz-meta-{name}"] = value
+        conditions.append({f"x-amz-meta-{name}": value})
+    return get_s3_client().generate_presigned_post(
+        BUCKET_NAME,
+        key,
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=expires_in
+    )
+
+def benchmark(file_count, file_size, prefix="benchmark/"):
+    # Wall time of serial uploads against one concurrent batch, objects are removed afterwards
+    payload = os.urandom(file_size)
+    keys = [f"{prefix}{index}" for index in range(file_count)]
+    timings = {}
+
+    started_at = time.perf_counter()
+    for key in keys:
+        upload_fileobj(io.BytesIO(payload), key)
+    timings["serial"] = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    upload_batch([{"key": key, "file": io.BytesIO(payload)} for key in keys])
+    timings["batch"] = time.perf_counter() - started_at
+
+    delete_objects(keys)
+    return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare serial and concurrent uploads against the configured bucket")
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 10, 50], help="file counts to try")
+    parser.add_argument("--size", type=int, nargs="+", default=[64 * 1024, 16 * 1024 * 1024], help="file sizes in bytes")
+    args = parser.parse_args()
+
+    for file_size in args.size:
+        for file_count in args.files:
+            timings = benchmark(file_count, file_size)
+            print(f"{file_count} x {file_size} bytes: serial {timings['serial']:.2f}s, batch {timings['batch']:.2f}s")
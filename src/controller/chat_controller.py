@@ -1,43 +1,181 @@
-from flask import Blueprint, request, jsonify
-from src.config.mongodb import client
+from flask import Blueprint, Response, request, jsonify
+from src.config.mongodb import get_collection
+from src.config.async_mongodb import AsyncCollection, run_blocking
+from src.config.lifecycle import register_startup, register_shutdown
 from bson import ObjectId
 from datetime import datetime
-import boto3
 import os
-from src.config.gemini import respond_to_message
+from src.config.gemini import respond_to_message, stream_message, GeminiBusyError
+from src.service.conversation_memory import build_conversation_context, schedule_summary_refresh
+from src.service.knowledge_index import retrieve_knowledge
+from src.service.chat_jobs import ChatJobQueue, ChatQueueFullError, STATUS_PENDING, STATUS_PROCESSING
+from pymongo import DESCENDING
 import asyncio
+import base64
+import json
+import time
+import logging
+import threading
 
 chat_controller = Blueprint("chat_controller", __name__, url_prefix="/api")
-db = client['alix_db']
-collection = db['chat']
-
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION')
-)
-BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
+collection = get_collection('chat')
+child_collection = get_collection('child')
+async_collection = AsyncCollection('chat')
+async_child_collection = AsyncCollection('child')
+
+# Long-poll settings for async chats
+CHAT_LONG_POLL_MAX = float(os.getenv("CHAT_LONG_POLL_MAX", "30"))
+CHAT_POLL_INTERVAL = float(os.getenv("CHAT_POLL_INTERVAL", "0.5"))
+CHAT_LONG_POLL_SLOTS = int(os.getenv("CHAT_LONG_POLL_SLOTS", "8"))  # long-polls waiting at once per worker
+
+# Every async view, a waiting long-poll included, holds one of the worker's WEB_THREADS request threads
+# until it returns, so only this many requests may wait at once; the rest answer with the current state
+long_poll_slots = threading.BoundedSemaphore(CHAT_LONG_POLL_SLOTS)
+
+# Chat history pagination
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_MAX_PAGE_SIZE = int(os.getenv("CHAT_MAX_PAGE_SIZE", "200"))
+CHAT_LIST_PROJECTION = {"child_id": 1, "question": 1, "response": 1, "created_at": 1, "status": 1, "error": 1}
 
 def serialize_chat(chat):
-    return {
+    serialized = {
         "_id": str(chat["_id"]),
         "child_id": str(chat["child_id"]),
         "question": chat["question"],
-        "response": chat["response"],
+        "response": chat.get("response"),
         "created_at": chat["created_at"].isoformat() if isinstance(chat["created_at"], datetime) else chat["created_at"]
     }
+    # Only chats created in async mode carry a status
+    if "status" in chat:
+        serialized["status"] = chat["status"]
+        if chat.get("error"):
+            serialized["error"] = chat["error"]
+    return serialized
+
+def encode_cursor(chat):
+    raw = f"{chat['created_at'].isoformat()}|{chat['_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    created_at, chat_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+    return datetime.fromisoformat(created_at), ObjectId(chat_id)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def uses_response_cache(child_id):
+    # Families can opt a child out of shared cached answers
+    child = child_collection.find_one({"_id": child_id}, {"response_cache_opt_out": 1})
+    return not (child or {}).get("response_cache_opt_out", False)
+
+async def uses_response_cache_async(child_id):
+    child = await async_child_collection.find_one({"_id": child_id}, {"response_cache_opt_out": 1})
+    return not (child or {}).get("response_cache_opt_out", False)
+
+def is_first_message(child_id, chat_id=None):
+    # The child's first chat gets the consultation prompt with the diagnosis document
+    return collection.find_one({"child_id": child_id, "_id": {"$ne": chat_id}}, {"_id": 1}) is None
+
+async def is_first_message_async(child_id):
+    return await async_collection.find_one({"child_id": child_id}, {"_id": 1}) is None
+
+async def stream_chat(chat_data, use_cache=True, history=None, knowledge=None, first_message=False):
+    started_at = time.perf_counter()
+    chunks = await stream_message(
+        chat_data["question"],
+        first_message=first_message,
+        use_cache=use_cache,
+        child_id=str(chat_data["child_id"]),
+        history=history,
+        knowledge=knowledge
+    )
+
+    def events():
+        response_parts = []
+        first_byte_at = None
+        try:
+            for text in chunks:
+                if first_byte_at is None:
+                    first_byte_at = time.perf_counter()
+                    logging.info(f"stream_chat time to first byte: {(first_byte_at - started_at) * 1000:.0f}ms")
+                response_parts.append(text)
+                yield sse_event("chunk", {"text": text})
+        except Exception as e:
+            print(f"Error streaming chat: {str(e)}")
+            yield sse_event("error", {"message": "I apologize, but I'm having trouble generating a response at the moment. Please try again later."})
+            return
+
+        # Persist the complete response once the stream has finished
+        chat_data["response"] = "".join(response_parts)
+        chat = collection.insert_one(chat_data)
+        chat_data["_id"] = chat.inserted_id
+        schedule_summary_refresh(chat_data["child_id"])
+        logging.info(f"stream_chat total time: {(time.perf_counter() - started_at) * 1000:.0f}ms")
+        yield sse_event("done", {"data": serialize_chat(chat_data)})
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def run_chat_job(chat):
+    # Same pipeline as the synchronous path, but errors propagate so the job can retry
+    use_cache = uses_response_cache(chat["child_id"])
+    history = build_conversation_context(chat["child_id"])
+    knowledge = retrieve_knowledge(str(chat["child_id"]), chat["question"])
+    # The queued chat is already stored, so it does not count as an earlier one
+    first_message = is_first_message(chat["child_id"], chat["_id"])
+    response = asyncio.run(respond_to_message(
+        chat["question"],
+        first_message=first_message,
+        use_cache=use_cache,
+        child_id=str(chat["child_id"]),
+        history=history,
+        knowledge=knowledge,
+        fallback=False
+    ))
+    schedule_summary_refresh(chat["child_id"])
+    return response
+
+chat_jobs = ChatJobQueue(collection, run_chat_job)
+register_startup(chat_jobs.start_recovery)
+register_shutdown(chat_jobs.shutdown)
 
 @chat_controller.route("/chat/<child_id>", methods=["GET"])
 def list_chats(child_id):
     try:
-        chats = collection.find(
-            {"child_id": ObjectId(child_id)}, 
-            sort=[("created_at", -1)]
-        )
+        limit = min(max(int(request.args.get("limit", CHAT_PAGE_SIZE)), 1), CHAT_MAX_PAGE_SIZE)
+        query = {"child_id": ObjectId(child_id)}
+
+        # Keyset pagination on (created_at, _id) so every page costs the same
+        cursor = request.args.get("next")
+        if cursor:
+            try:
+                created_at, last_id = decode_cursor(cursor)
+            except Exception:
+                return jsonify({"message": "Invalid cursor"}), 400
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": last_id}}
+            ]
+
+        chats = list(collection.find(
+            query,
+            CHAT_LIST_PROJECTION,
+            sort=[("created_at", DESCENDING), ("_id", DESCENDING)],
+            limit=limit + 1
+        ))
+        has_more = len(chats) > limit
+        chats = chats[:limit]
+
         serialized_chats = [serialize_chat(chat) for chat in chats]
-        return jsonify({"data": serialized_chats}), 200
+        return jsonify({
+            "data": serialized_chats,
+            "next": encode_cursor(chats[-1]) if has_more else None
+        }), 200
+    except ValueError as e:
+        return jsonify({"message": f"Invalid parameter: {str(e)}"}), 400
     except Exception as e:
         print(f"Error in list_chats: {str(e)}")
         return jsonify({"message": str(e)}), 500
@@ -51,20 +189,87 @@ async def send_chat(child_id):
             "question": request_data["question"],
             "created_at": datetime.now()
         }
+
+        # Queue the chat and answer right away with ?async=1, clients poll for the response
+        if request.args.get("async") in ("1", "true"):
+            chat_id = await run_blocking(chat_jobs.submit, chat_data)
+            return jsonify({"data": {"_id": str(chat_id), "status": STATUS_PENDING}}), 202
+
+        # Cache opt-out, conversation memory (latest turns plus rolling summary) and the
+        # knowledge-base chunks most relevant to this question are independent, fetch them concurrently
+        use_cache, history, knowledge, first_message = await asyncio.gather(
+            uses_response_cache_async(chat_data["child_id"]),
+            run_blocking(build_conversation_context, chat_data["child_id"]),
+            run_blocking(retrieve_knowledge, child_id, chat_data["question"]),
+            is_first_message_async(chat_data["child_id"])
+        )
+
+        # Relay tokens as Server-Sent Events with ?stream=1
+        if request.args.get("stream") in ("1", "true"):
+            return await stream_chat(chat_data, use_cache, history, knowledge, first_message)
         
         # Get AI response
-        response = await respond_to_message(request_data["question"])
+        response = await respond_to_message(
+            request_data["question"],
+            first_message=first_message,
+            use_cache=use_cache,
+            child_id=child_id,
+            history=history,
+            knowledge=knowledge
+        )
         chat_data["response"] = response
         
         # Insert into database
-        chat = collection.insert_one(chat_data)
+        chat = await async_collection.insert_one(chat_data)
+        chat_data["_id"] = chat.inserted_id
+        schedule_summary_refresh(chat_data["child_id"])
         
         # Return the complete chat object
-        inserted_chat = collection.find_one({"_id": chat.inserted_id})
-        return jsonify({"data": serialize_chat(inserted_chat)}), 201
+        return jsonify({"data": serialize_chat(chat_data)}), 201
     except KeyError as e:
         print(f"KeyError in send_chat: {str(e)}")
         return jsonify({"message": "Missing required field: question"}), 400
+    except (GeminiBusyError, ChatQueueFullError) as e:
+        print(f"Chat busy in send_chat: {str(e)}")
+        return jsonify({"message": str(e)}), 503
     except Exception as e:
         print(f"Error in send_chat: {str(e)}")
         return jsonify({"message": str(e)}), 500
+
+@chat_controller.route("/chat/<child_id>/<chat_id>", methods=["GET"])
+async def get_chat(child_id, chat_id):
+    try:
+        try:
+            wait = min(float(request.args.get("wait", 0)), CHAT_LONG_POLL_MAX)
+        except ValueError:
+            return jsonify({"message": "Invalid parameter: wait must be a number of seconds"}), 400
+
+        query = {"_id": ObjectId(chat_id), "child_id": ObjectId(child_id)}
+        chat = await async_collection.find_one(query)
+        if not chat:
+            return jsonify({"message": "Chat not found"}), 404
+
+        # Long-poll with ?wait=<seconds> until the async job finishes. The wait keeps the event loop
+        # free but holds this request's thread, so it only happens while a long-poll slot is free.
+        if wait > 0 and chat.get("status") in (STATUS_PENDING, STATUS_PROCESSING) \
+                and long_poll_slots.acquire(blocking=False):
+            try:
+                if not await chat_jobs.wait(chat["_id"], wait):
+                    # The job runs in another worker, fall back to polling the database
+                    loop = asyncio.get_running_loop()
+                    deadline = loop.time() + wait
+                    while loop.time() < deadline:
+                        await asyncio.sleep(CHAT_POLL_INTERVAL)
+                        status = await async_collection.find_one(query, {"status": 1})
+                        if status is None or status.get("status") not in (STATUS_PENDING, STATUS_PROCESSING):
+                            break
+            finally:
+                long_poll_slots.release()
+            chat = await async_collection.find_one(query)
+            if not chat:
+                return jsonify({"message": "Chat not found"}), 404
+
+        return jsonify({"data": serialize_chat(chat)}), 200
+    except Exception as e:
+        print(f"Error in get_chat: {str(e)}")
+        return jsonify({"message": str(e)}), 500
@@ -1,70 +1,84 @@
 from flask import Blueprint, request, jsonify
-from src.config.mongodb import client
+from src.config.mongodb import get_client, get_collection
+from src.config import storage
+from concurrent.futures import ThreadPoolExecutor
 from bson import ObjectId
 from datetime import datetime
 import random
 import string
-import boto3
 import os
 import logging
 from src.middleware.auth_middleware import token_required
-from werkzeug.utils import secure_filename
+from pymongo.errors import DuplicateKeyError
+from src.service.knowledge_index import schedule_ingest
+from src.service import knowledge_base_files
+from src.service.access import get_access, has_access, invalidate_access
+from src.config.lifecycle import register_shutdown
+from src.service.support_group_members import (
+    split_members, insert_members, delete_members, new_member, get_memberships
+)
 
 child_controller = Blueprint("child_controller", __name__, url_prefix="/api")
-db = client['alix_db']
-child_collection = db['child']
-support_group_collection = db['support_group']
-
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION')
-)
-BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
+child_collection = get_collection('child')
+support_group_collection = get_collection('support_group')
 
 # File upload settings
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB limit per file
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
 
+# Support codes are unique, retry this many times on a collision
+SUPPORT_CODE_ATTEMPTS = 5
+
+# Child creation settings
+CREATE_CHILD_TRANSACTION = os.getenv("CREATE_CHILD_TRANSACTION", "false").lower() == "true"  # needs a replica set
+create_child_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CREATE_CHILD_WORKERS", "8")),
+    thread_name_prefix="create-child"
+)
+register_shutdown(lambda: create_child_executor.shutdown(wait=True))
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def generate_support_code():
     return ''.join(random.choices(string.digits, k=6))
 
-def upload_file_to_s3(file, child_id, index):
+def write_child_documents(child, support_group):
+    # Both documents are complete up front, so no follow-up update is needed
+    group_document, members = split_members(support_group)
+    if CREATE_CHILD_TRANSACTION:
+        with get_client().start_session() as session:
+            session.with_transaction(lambda s: (
+                child_collection.insert_one(child, session=s),
+                support_group_collection.insert_one(group_document, session=s),
+                insert_members(group_document["_id"], members, session=s)
+            ))
+        return
+
+    child_collection.insert_one(child)
     try:
-        # Generate timestamp-based filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        original_extension = os.path.splitext(secure_filename(file.filename))[1]
-        new_filename = f"{timestamp}_{index}{original_extension}"
-        
-        # Upload to child's folder
-        file_key = f"{child_id}/{new_filename}"
-        
-        # Upload to S3
-        s3_client.upload_fileobj(
-            file,
-            BUCKET_NAME,
-            file_key,
-            ExtraArgs={'ContentType': file.content_type}
-        )
-        
-        return {
-            "success": True,
-            "filename": new_filename,
-            "original_name": file.filename,
-            "content_type": file.content_type
-        }
-    except Exception as e:
-        logging.error(f"Error uploading file {file.filename}: {str(e)}")
-        return {
-            "success": False,
-            "filename": file.filename,
-            "error": str(e)
-        }
+        support_group_collection.insert_one(group_document)
+        insert_members(group_document["_id"], members)
+    except Exception:
+        delete_child_documents(child, support_group)
+        raise
+
+def create_child_documents(child, support_group):
+    for attempt in range(SUPPORT_CODE_ATTEMPTS):
+        try:
+            write_child_documents(child, support_group)
+            return
+        except DuplicateKeyError:
+            if attempt == SUPPORT_CODE_ATTEMPTS - 1:
+                raise
+            support_code = generate_support_code()
+            child["support_code"] = support_code
+            support_group["code"] = support_code
+
+def delete_child_documents(child, support_group):
+    child_collection.delete_one({"_id": child["_id"]})
+    support_group_collection.delete_one({"_id": support_group["_id"]})
+    delete_members(support_group["_id"])
 
 @child_controller.route("/child", methods=["POST"])
 @token_required
@@ -90,29 +104,28 @@ def create_child():
         parent_uid = request.user['uid']
         parent_name = request.user.get('name', 'Parent')
         
-        # Generate support group code
+        # Ids are generated client-side so both documents reference each other from the start
+        child_object_id = ObjectId()
+        support_group_object_id = ObjectId()
+        child_id = str(child_object_id)
+        support_group_id = str(support_group_object_id)
         support_code = generate_support_code()
+        now = datetime.now()
         
         # Create support group document
         support_group = {
+            "_id": support_group_object_id,
             "code": support_code,
             "name": f"{data['name']}'s Support Group",  # Add group name
-            "child_id": None,  # Will be set after child creation
-            "members": [{
-                "uid": parent_uid,
-                "name": parent_name,
-                "role": "parent",
-                "joined_at": datetime.now()
-            }],
-            "created_at": datetime.now(),
-            "updated_at": datetime.now()
+            "child_id": child_id,
+            "members": [new_member(parent_uid, parent_name, "parent", now)],
+            "created_at": now,
+            "updated_at": now
         }
         
-        support_group_result = support_group_collection.insert_one(support_group)
-        support_group_id = str(support_group_result.inserted_id)
-        
         # Create child document
         child = {
+            "_id": child_object_id,
             "name": data['name'],
             "birthday": data['birthday'],
             "sex": data['sex'],
@@ -120,65 +133,86 @@ def create_child():
             "parent_uid": parent_uid,
             "support_group_id": support_group_id,
             "support_code": support_code,
-            "created_at": datetime.now(),
-            "updated_at": datetime.now()
+            "created_at": now,
+            "updated_at": now
         }
         
         # Log the support group ID for debugging
         logging.info(f"Creating child with support_group_id: {child['support_group_id']}")
-        
-        result = child_collection.insert_one(child)
-        child_id = str(result.inserted_id)
-        
-        # Update support group with child ID
-        support_group_collection.update_one(
-            {"_id": support_group_result.inserted_id},
-            {"$set": {"child_id": child_id}}
-        )
 
-        # Create S3 folder for the child
-        try:
-            s3_client.put_object(Bucket=BUCKET_NAME, Key=f"{child_id}/")
-            logging.info(f"Created S3 folder for child {child_id}")
-        except Exception as e:
-            logging.error(f"Failed to create S3 folder for child {child_id}: {str(e)}")
-            # Delete the child document since folder creation failed
-            child_collection.delete_one({"_id": result.inserted_id})
-            return jsonify({"error": f"Failed to create storage for child: {str(e)}"}), 500
-        
         # Handle file uploads
         uploaded_files = []
         skipped_files = []
+        files = []
         
         if request.files and 'files' in request.files:
             files = request.files.getlist('files')
             logging.info(f"Processing {len(files)} files")
-            
-            for index, file in enumerate(files):
-                if not file or file.filename == '':
-                    continue
-                    
-                if not allowed_file(file.filename):
-                    skipped_files.append({
-                        "filename": file.filename,
-                        "reason": "File type not allowed"
-                    })
-                    continue
-                
-                # Upload file to S3
-                upload_result = upload_file_to_s3(file, child_id, index)
+
+        uploads = []
+        for file in files:
+            if not file or file.filename == '':
+                continue
                 
-                if upload_result["success"]:
-                    uploaded_files.append({
-                        "original_name": upload_result["original_name"],
-                        "stored_name": upload_result["filename"],
-                        "content_type": upload_result["content_type"]
-                    })
-                else:
-                    skipped_files.append({
-                        "filename": upload_result["filename"],
-                        "reason": upload_result["error"]
-                    })
+            if not allowed_file(file.filename):
+                skipped_files.append({
+                    "filename": file.filename,
+                    "reason": "File type not allowed"
+                })
+                continue
+            
+            uploads.append(knowledge_base_files.prepare_upload(file, child_id))
+
+        # Database writes, the S3 folder marker and the file uploads run concurrently;
+        # with ?atomic=1 a single failed file rolls back the whole upload batch
+        rollback = request.args.get("atomic") in ("1", "true")
+        documents_future = create_child_executor.submit(create_child_documents, child, support_group)
+        folder_future = create_child_executor.submit(storage.put_object, f"{child_id}/")
+        upload_future = create_child_executor.submit(storage.upload_batch, uploads, rollback)
+
+        upload_results = upload_future.result()
+        uploaded_keys = [f"{child_id}/"] + [result["key"] for result in upload_results if result["success"]]
+
+        try:
+            documents_future.result()
+        except Exception as e:
+            # Compensate: nothing in storage may outlive a child that was never created
+            logging.error(f"Failed to create child documents: {str(e)}")
+            folder_future.exception()
+            storage.delete_objects(uploaded_keys)
+            raise
+
+        try:
+            folder_future.result()
+            logging.info(f"Created S3 folder for child {child_id}")
+        except Exception as e:
+            logging.error(f"Failed to create S3 folder for child {child_id}: {str(e)}")
+            # Delete the child and its support group since folder creation failed
+            delete_child_documents(child, support_group)
+            storage.delete_objects(uploaded_keys[1:])
+            return jsonify({"error": f"Failed to create storage for child: {str(e)}"}), 500
+
+        records = []
+        for upload, upload_result in zip(uploads, upload_results):
+            if upload_result["success"]:
+                uploaded_files.append({
+                    "original_name": upload["original_name"],
+                    "stored_name": upload["filename"],
+                    "content_type": upload["content_type"]
+                })
+                if upload["data"] is not None:
+                    schedule_ingest(child_id, upload["key"], upload["original_name"], upload["data"])
+                records.append(knowledge_base_files.file_record(
+                    child_id, upload["key"], upload["original_name"], upload["size"],
+                    upload["content_type"], upload["hash"]
+                ))
+            else:
+                logging.error(f"Error uploading file {upload['original_name']}: {upload_result['error']}")
+                skipped_files.append({
+                    "filename": upload["original_name"],
+                    "reason": upload_result["error"]
+                })
+        knowledge_base_files.record_files(records)
         
         # Convert ObjectId to string for JSON serialization
         child_response = {
@@ -216,43 +250,32 @@ def get_all_children():
         parent_uid = request.user['uid']
         logging.info(f"Getting children for user: {parent_uid}")
 
+        # Get all support groups where this user is a member, with this user's role in each
+        support_groups = get_memberships(parent_uid)
+        logging.info(f"Found {len(support_groups)} support groups for user")
+
+        # One query for the parent's own children and the children of every support group
+        query = {"parent_uid": parent_uid}
+        if support_groups:
+            query = {"$or": [query, {"support_group_id": {"$in": list(support_groups)}}]}
+
         children = []
-        
-        # First get parent's own children
-        parent_children = child_collection.find({"parent_uid": parent_uid})
-        for child in parent_children:
+        support_children = []
+        for child in child_collection.find(query):
             child['_id'] = str(child['_id'])
-            child['is_support_child'] = False
-            children.append(child)
-            logging.info(f"Found parent's child: {child.get('name')}")
+            if child.get('parent_uid') == parent_uid:
+                child['is_support_child'] = False
+                children.append(child)
+                continue
 
-        # Get all support groups where this user is a member
-        support_groups = list(support_group_collection.find({"members.uid": parent_uid}))
-        logging.info(f"Found {len(support_groups)} support groups for user")
-        
-        for group in support_groups:
-            group_id = str(group["_id"])
-            logging.info(f"Processing support group: {group_id}")
-            
-            # Find children that belong to this support group
-            support_children = child_collection.find({
-                "support_group_id": group_id,
-                "parent_uid": {"$ne": parent_uid}  # Exclude own children
+            group = support_groups[child['support_group_id']]
+            support_children.append({
+                **child,
+                'is_support_child': True,
+                'support_group_name': group.get('name') or 'Support Group',
+                'support_group_role': group.get('role') or 'member'
             })
-            
-            for child in support_children:
-                logging.info(f"Found support group child: {child.get('name')} in group {group_id}")
-                child_dict = {
-                    **child,
-                    '_id': str(child['_id']),
-                    'is_support_child': True,
-                    'support_group_name': group.get('name', 'Support Group'),
-                    'support_group_role': next(
-                        (m['role'] for m in group['members'] if m['uid'] == parent_uid),
-                        'member'
-                    )
-                }
-                children.append(child_dict)
+        children.extend(support_children)
 
         # Log all found children
         for child in children:
@@ -278,15 +301,14 @@ def get_child(id):
         # Get parent_uid from the authenticated user
         parent_uid = request.user['uid']
         
-        # Query child with both ID and parent_uid for security
-        child = child_collection.find_one({
-            "_id": ObjectId(id),
-            "parent_uid": parent_uid
-        })
+        # Only the parent can read the child document
+        access = get_access(parent_uid, id)
         
-        if child:
-            child['_id'] = str(child['_id'])
-            return jsonify(child), 200
+        if has_access(access):
+            child = child_collection.find_one({"_id": ObjectId(id)})
+            if child:
+                child['_id'] = str(child['_id'])
+                return jsonify(child), 200
         return jsonify({"error": "Child not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -306,7 +328,7 @@ def update_child(id):
         }
         
         # Add fields that are present in the request
-        for field in ['name', 'birthday', 'sex', 'asd_type']:
+        for field in ['name', 'birthday', 'sex', 'asd_type', 'response_cache_opt_out']:
             if field in data:
                 update_data[field] = data[field]
         
@@ -320,6 +342,7 @@ def update_child(id):
         )
         
         if result.modified_count:
+            invalidate_access(id)
             child = child_collection.find_one({"_id": ObjectId(id)})
             child['_id'] = str(child['_id'])
             return jsonify(child), 200
@@ -329,7 +352,7 @@ def update_child(id):
         return jsonify({"error": str(e)}), 500
 
 @child_controller.route("/child/<id>", methods=["DELETE"])
-@token_required
+@token_required(check_revoked=True)
 def delete_child(id):
     try:
         # Get parent_uid from the authenticated user
@@ -342,6 +365,7 @@ def delete_child(id):
         })
         
         if result.deleted_count:
+            invalidate_access(id)
             return jsonify({"message": "Child deleted successfully"}), 200
         return jsonify({"error": "Child not found or unauthorized"}), 404
     except Exception as e:
@@ -1,44 +1,54 @@
 from flask import Blueprint, request, jsonify
-from src.config.mongodb import client
-from bson import ObjectId
 from datetime import datetime
-import boto3
 import os
 import logging
 from botocore.exceptions import ClientError
 from src.middleware.auth_middleware import token_required
-from werkzeug.utils import secure_filename
+from src.config import storage
+from src.service.context_documents import invalidate_context_document
+from src.service.knowledge_index import is_indexable, schedule_ingest, remove_file
+from src.service.access import get_access, has_access, PARENT, MEMBER
+from src.service import knowledge_base_files
+from src.service.signed_urls import sign_files, invalidate_signed_url
+from urllib.parse import quote, unquote
 
 knowledge_base_controller = Blueprint("knowledge_base_controller", __name__, url_prefix="/api")
-db = client['alix_db']
-child_collection = db['child']
-
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION')
-)
-BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'txt'}
 
+# Direct-to-S3 upload settings, each extension may only be uploaded with its own content type
+DIRECT_UPLOAD_MAX_SIZE = int(os.getenv("DIRECT_UPLOAD_MAX_SIZE", str(50 * 1024 * 1024)))
+DIRECT_UPLOAD_EXPIRY = int(os.getenv("DIRECT_UPLOAD_EXPIRY", "900"))
+DIRECT_UPLOAD_MAX_FILES = int(os.getenv("DIRECT_UPLOAD_MAX_FILES", "50"))
+
+# Most files a single batch-sign request may ask for
+SIGN_BATCH_MAX_FILES = int(os.getenv("SIGN_BATCH_MAX_FILES", "100"))
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'pdf': 'application/pdf',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'txt': 'text/plain'
+}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def ensure_child_folder(child_id):
     try:
         # Try to check if folder exists
-        s3_client.head_object(Bucket=BUCKET_NAME, Key=f"{child_id}/")
-        logging.info(f"Folder {child_id}/ already exists in bucket {BUCKET_NAME}")
+        storage.head_object(f"{child_id}/")
+        logging.info(f"Folder {child_id}/ already exists in bucket {storage.BUCKET_NAME}")
     except ClientError as e:
         error_code = int(e.response['Error']['Code'])
         if error_code == 404:  # If folder doesn't exist
             try:
                 # Create the folder
-                s3_client.put_object(Bucket=BUCKET_NAME, Key=f"{child_id}/")
-                logging.info(f"Created folder {child_id}/ in bucket {BUCKET_NAME}")
+                storage.put_object(f"{child_id}/")
+                logging.info(f"Created folder {child_id}/ in bucket {storage.BUCKET_NAME}")
             except Exception as create_error:
                 logging.error(f"Failed to create folder {child_id}/: {str(create_error)}")
                 raise create_error
@@ -56,12 +66,9 @@ def upload_files(child_id):
         logging.info(f"Upload request received for child {child_id}")
         
         # Verify child access
-        child = child_collection.find_one({
-            "_id": ObjectId(child_id),
-            "parent_uid": request.user['uid']
-        })
+        access = get_access(request.user['uid'], child_id)
         
-        if not child:
+        if not has_access(access):
             logging.warning(f"Access denied for child {child_id} by user {request.user['uid']}")
             return jsonify({"error": "Child not found or access denied"}), 404
             
@@ -80,6 +87,7 @@ def upload_files(child_id):
         uploaded_files = []
         failed_files = []
         
+        uploads = []
         for file in files:
             if file.filename == '':
                 continue
@@ -92,38 +100,38 @@ def upload_files(child_id):
                 logging.warning(f"Skipping file {file.filename}: File type not allowed")
                 continue
                 
-            try:
-                # Generate timestamp-based filename
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                original_extension = os.path.splitext(secure_filename(file.filename))[1]
-                new_filename = f"{timestamp}_{len(uploaded_files)}{original_extension}"
-                
-                # Upload to child's folder
-                file_key = f"{child_id}/{new_filename}"
-                
-                # Upload to S3
-                s3_client.upload_fileobj(
-                    file,
-                    BUCKET_NAME,
-                    file_key,
-                    ExtraArgs={'ContentType': file.content_type}
-                )
-                
-                logging.info(f"Successfully uploaded file {file.filename} as {file_key}")
-                
-                uploaded_files.append({
-                    "original_name": file.filename,
-                    "stored_name": new_filename,
-                    "content_type": file.content_type
-                })
-            except Exception as e:
-                error_msg = f"Failed to upload {file.filename}: {str(e)}"
-                logging.error(error_msg)
+            uploads.append(knowledge_base_files.prepare_upload(file, child_id))
+        
+        # Upload the batch concurrently; ?atomic=1 rolls back every file if any of them fails
+        rollback = request.args.get("atomic") in ("1", "true")
+        results = storage.upload_batch(uploads, rollback=rollback)
+        
+        records = []
+        for upload, result in zip(uploads, results):
+            file = upload["file"]
+            if not result["success"]:
+                logging.error(f"Failed to upload {file.filename}: {result['error']}")
                 failed_files.append({
                     "filename": file.filename,
-                    "error": str(e)
+                    "error": result["error"]
                 })
-        
+                continue
+                
+            logging.info(f"Successfully uploaded file {file.filename} as {upload['key']}")
+
+            if upload["data"] is not None:
+                schedule_ingest(child_id, upload["key"], file.filename, upload["data"])
+            records.append(knowledge_base_files.file_record(
+                child_id, upload["key"], file.filename, upload["size"], file.content_type, upload["hash"]
+            ))
+            
+            uploaded_files.append({
+                "original_name": file.filename,
+                "stored_name": upload["filename"],
+                "content_type": file.content_type
+            })
+        knowledge_base_files.record_files(records)
+
         response = {
             "message": f"Successfully uploaded {len(uploaded_files)} files",
             "files": uploaded_files
@@ -140,51 +148,214 @@ def upload_files(child_id):
         logging.error(error_msg)
         return jsonify({"error": error_msg}), 500
 
+@knowledge_base_controller.route("/knowledge-base/<child_id>/upload-url", methods=["POST"])
+@token_required
+def create_upload_urls(child_id):
+    try:
+        # Verify parent access, same as the proxied upload
+        access = get_access(request.user['uid'], child_id)
+        
+        if not has_access(access):
+            return jsonify({"error": "Child not found or access denied"}), 404
+            
+        data = request.json or {}
+        files = data.get('files') or []
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+        if len(files) > DIRECT_UPLOAD_MAX_FILES:
+            return jsonify({"error": f"At most {DIRECT_UPLOAD_MAX_FILES} files per request"}), 400
+            
+        ensure_child_folder(child_id)
+        
+        uploads = []
+        failed_files = []
+        for file in files:
+            filename = file.get('filename', '')
+            if not allowed_file(filename):
+                failed_files.append({"filename": filename, "error": "File type not allowed"})
+                continue
+            if file.get('size') and file['size'] > DIRECT_UPLOAD_MAX_SIZE:
+                failed_files.append({"filename": filename, "error": "File is too large"})
+                continue
+                
+            # The policy pins the key inside the child's folder, the content type and the size range
+            content_type = CONTENT_TYPES[filename.rsplit('.', 1)[1].lower()]
+            file_key = f"{child_id}/{knowledge_base_files.stored_filename(filename)}"
+            post = storage.generate_presigned_post(
+                file_key,
+                content_type,
+                DIRECT_UPLOAD_MAX_SIZE,
+                metadata={"original-name": quote(filename)},
+                expires_in=DIRECT_UPLOAD_EXPIRY
+            )
+            uploads.append({
+                "filename": filename,
+                "key": file_key,
+                "content_type": content_type,
+                "url": post["url"],
+                "fields": post["fields"]
+            })
+            
+        response = {"uploads": uploads, "expires_in": DIRECT_UPLOAD_EXPIRY, "max_size": DIRECT_UPLOAD_MAX_SIZE}
+        if failed_files:
+            response["failed_files"] = failed_files
+        return jsonify(response), 200 if uploads else 400
+        
+    except Exception as e:
+        logging.error(f"Error creating upload URLs: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@knowledge_base_controller.route("/knowledge-base/<child_id>/upload/complete", methods=["POST"])
+@token_required
+def complete_upload(child_id):
+    try:
+        # Verify parent access
+        access = get_access(request.user['uid'], child_id)
+        
+        if not has_access(access):
+            return jsonify({"error": "Child not found or access denied"}), 404
+            
+        keys = (request.json or {}).get('keys') or []
+        if not keys:
+            return jsonify({"error": "No keys provided"}), 400
+            
+        uploaded_files = []
+        failed_files = []
+        records = []
+        for file_key in keys:
+            # Only objects directly inside this child's folder can be completed
+            filename = file_key[len(f"{child_id}/"):] if file_key.startswith(f"{child_id}/") else ''
+            if not filename or '/' in filename:
+                failed_files.append({"key": file_key, "error": "Invalid key"})
+                continue
+                
+            try:
+                head = storage.head_object(file_key)
+            except ClientError:
+                failed_files.append({"key": file_key, "error": "File was not uploaded"})
+                continue
+                
+            original_name = unquote(head.get('Metadata', {}).get('original-name', filename))
+            schedule_ingest(child_id, file_key, original_name)
+                
+            # The bytes never passed through the API, so the ETag stands in for a content hash
+            records.append(knowledge_base_files.file_record(
+                child_id,
+                file_key,
+                original_name,
+                head.get('ContentLength'),
+                head.get('ContentType'),
+                etag=head.get('ETag', '').strip('"')
+            ))
+            logging.info(f"Completed direct upload of {original_name} as {file_key}")
+            uploaded_files.append({
+                "original_name": original_name,
+                "stored_name": filename,
+                "content_type": head.get('ContentType'),
+                "size": head.get('ContentLength')
+            })
+            
+        knowledge_base_files.record_files(records)
+            
+        response = {
+            "message": f"Successfully uploaded {len(uploaded_files)} files",
+            "files": uploaded_files
+        }
+        if failed_files:
+            response["failed_files"] = failed_files
+            response["warning"] = f"{len(failed_files)} files could not be completed"
+            
+        return jsonify(response), 200 if uploaded_files else 400
+        
+    except Exception as e:
+        logging.error(f"Error completing upload: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @knowledge_base_controller.route("/knowledge-base/<child_id>/files", methods=["GET"])
 @token_required
 def list_files(child_id):
     try:
-        # Verify child access
-        child = child_collection.find_one({
-            "_id": ObjectId(child_id),
-            "$or": [
-                {"parent_uid": request.user['uid']},
-                {"support_group_id": {"$exists": True}}
-            ]
-        })
-        
-        if not child:
+        # Verify child access for the parent and support group members
+        access = get_access(request.user['uid'], child_id)
+        
+        if not has_access(access, (PARENT, MEMBER)):
             return jsonify({"error": "Child not found or access denied"}), 404
             
-        # List objects in child's folder
-        response = s3_client.list_objects_v2(
-            Bucket=BUCKET_NAME,
-            Prefix=f"{child_id}/"
-        )
+        # Indexed, paginated query: ?limit=&next=&type=image/&from=&to= (ISO dates)
+        try:
+            limit = int(request.args.get("limit", knowledge_base_files.FILES_PAGE_SIZE))
+            uploaded_after = request.args.get("from")
+            uploaded_before = request.args.get("to")
+            records, next_cursor = knowledge_base_files.list_files(
+                child_id,
+                limit=limit,
+                cursor=request.args.get("next"),
+                content_type=request.args.get("type"),
+                uploaded_after=datetime.fromisoformat(uploaded_after) if uploaded_after else None,
+                uploaded_before=datetime.fromisoformat(uploaded_before) if uploaded_before else None
+            )
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+        
+        # Signed URLs are reused from the cache until close to expiry; with ?sign=lazy none are
+        # returned and clients sign the files they open through /files/sign
+        signed_urls = {} if request.args.get("sign") == "lazy" else sign_files(records)
         
         files = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                # Skip the folder itself
-                if not obj['Key'].endswith('/'):
-                    # Generate presigned URL for each file
-                    url = s3_client.generate_presigned_url(
-                        'get_object',
-                        Params={
-                            'Bucket': BUCKET_NAME,
-                            'Key': obj['Key']
-                        },
-                        ExpiresIn=3600  # URL expires in 1 hour
-                    )
-                    
-                    files.append({
-                        "filename": os.path.basename(obj['Key']),
-                        "size": obj['Size'],
-                        "last_modified": obj['LastModified'].isoformat(),
-                        "url": url
-                    })
-        
-        return jsonify({"files": files}), 200
+        for record in records:
+            file = {
+                "key": record['key'],
+                "filename": record['filename'],
+                "original_name": record.get('original_name'),
+                "content_type": record.get('content_type'),
+                "size": record['size'],
+                "hash": record.get('hash'),
+                "is_diagnosis": record.get('is_diagnosis', False),
+                "last_modified": record['uploaded_at'].isoformat()
+            }
+            signed_url = signed_urls.get(record['key'])
+            if signed_url:
+                file["url"] = signed_url["url"]
+                file["url_expires_at"] = signed_url["expires_at"]
+            files.append(file)
+        
+        return jsonify({"files": files, "next": next_cursor}), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@knowledge_base_controller.route("/knowledge-base/<child_id>/files/sign", methods=["POST"])
+@token_required
+def sign_file_urls(child_id):
+    try:
+        # Verify child access for the parent and support group members
+        access = get_access(request.user['uid'], child_id)
+        
+        if not has_access(access, (PARENT, MEMBER)):
+            return jsonify({"error": "Child not found or access denied"}), 404
+            
+        filenames = (request.json or {}).get('filenames') or []
+        if not filenames:
+            return jsonify({"error": "No filenames provided"}), 400
+        if len(filenames) > SIGN_BATCH_MAX_FILES:
+            return jsonify({"error": f"At most {SIGN_BATCH_MAX_FILES} files per request"}), 400
+            
+        # Only files recorded in this child's folder are signed
+        records = knowledge_base_files.get_files(child_id, filenames)
+        signed_urls = sign_files(records)
+        urls = {
+            record['filename']: {
+                "url": signed_urls[record['key']]["url"],
+                "expires_at": signed_urls[record['key']]["expires_at"]
+            }
+            for record in records
+        }
+        
+        response = {"urls": urls}
+        missing = [filename for filename in filenames if filename not in urls]
+        if missing:
+            response["missing"] = missing
+        return jsonify(response), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -194,22 +365,52 @@ def list_files(child_id):
 def delete_file(child_id, filename):
     try:
         # Verify parent access (only parents can delete files)
-        child = child_collection.find_one({
-            "_id": ObjectId(child_id),
-            "parent_uid": request.user['uid']
-        })
+        access = get_access(request.user['uid'], child_id)
         
-        if not child:
+        if not has_access(access):
             return jsonify({"error": "Child not found or access denied"}), 404
             
         # Delete file from S3
         file_key = f"{child_id}/{filename}"
-        s3_client.delete_object(
-            Bucket=BUCKET_NAME,
-            Key=file_key
-        )
+        storage.delete_object(file_key)
+        knowledge_base_files.forget_files([file_key])
+        invalidate_signed_url(file_key)
+        # The deleted file may have been the child's diagnosis document
+        invalidate_context_document(child_id)
+        remove_file(child_id, file_key)
         
         return jsonify({"message": "File deleted successfully"}), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@knowledge_base_controller.route("/knowledge-base/<child_id>/diagnosis", methods=["PUT", "DELETE"])
+@token_required
+def set_diagnosis(child_id):
+    try:
+        # Verify parent access (only parents choose the diagnosis document)
+        access = get_access(request.user['uid'], child_id)
+        
+        if not has_access(access):
+            return jsonify({"error": "Child not found or access denied"}), 404
+            
+        # PUT {"filename": <stored name>} flags one uploaded text document, DELETE clears the flag
+        file_key = None
+        if request.method == "PUT":
+            filename = (request.json or {}).get('filename')
+            if not filename:
+                return jsonify({"error": "No filename provided"}), 400
+            records = knowledge_base_files.get_files(child_id, [filename])
+            if not records:
+                return jsonify({"error": "File not found"}), 404
+            if not is_indexable(records[0].get('original_name') or filename):
+                return jsonify({"error": "Only text, Markdown, PDF and Word documents can be the diagnosis"}), 400
+            file_key = records[0]['key']
+            
+        knowledge_base_files.set_diagnosis_file(child_id, file_key)
+        invalidate_context_document(child_id)
+        
+        return jsonify({"message": "Diagnosis document updated", "filename": os.path.basename(file_key) if file_key else None}), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
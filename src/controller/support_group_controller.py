@@ -1,15 +1,21 @@
 from flask import Blueprint, request, jsonify
-from src.config.mongodb import client
+from src.config.mongodb import get_collection
 from bson import ObjectId
-from datetime import datetime
 from src.middleware.auth_middleware import token_required
+from src.service.access import get_access, has_access, invalidate_access, PARENT, MEMBER
+from src.service.support_group_members import (
+    add_member, list_members, update_member, remove_member as remove_group_member, new_member,
+    parse_fields, MEMBER_PAGE_SIZE
+)
+from pymongo.errors import DuplicateKeyError
 import random
 import string
 
 support_group_controller = Blueprint("support_group_controller", __name__, url_prefix="/api")
-db = client['alix_db']
-child_collection = db['child']
-support_group_collection = db['support_group']
+child_collection = get_collection('child')
+
+# Support codes are unique, retry this many times on a collision
+SUPPORT_CODE_ATTEMPTS = 5
 
 def generate_new_code():
     return ''.join(random.choices(string.digits, k=6))
@@ -26,42 +32,26 @@ def join_support_group():
         user_uid = request.user['uid']
         user_name = request.user.get('name', 'Support Member')
         
-        # Find child with this support code
-        child = child_collection.find_one({"support_code": data['code']})
+        # Resolve the group through the unique support_code index
+        child = child_collection.find_one(
+            {"support_code": data['code']},
+            {"name": 1, "support_group_id": 1}
+        )
         if not child:
             return jsonify({"error": "Invalid support group code"}), 404
             
-        # Check if user is already in the support group
-        support_group = support_group_collection.find_one({
-            "_id": ObjectId(child['support_group_id']),
-            "members.uid": user_uid
-        })
+        # The membership check is part of the write itself, so concurrent joins
+        # by the same user can never add a duplicate member
+        joined = add_member(child['support_group_id'], new_member(user_uid, user_name, "none"))
         
-        if support_group:
+        if not joined:
             return jsonify({"error": "You are already a member of this support group"}), 400
             
-        # Add user to support group
-        result = support_group_collection.update_one(
-            {"_id": ObjectId(child['support_group_id'])},
-            {
-                "$push": {
-                    "members": {
-                        "uid": user_uid,
-                        "name": user_name,
-                        "role": "none",
-                        "joined_at": datetime.utcnow()
-                    }
-                },
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
-        
-        if result.modified_count:
-            return jsonify({
-                "message": "Successfully joined support group",
-                "child_name": child['name']
-            }), 200
-        return jsonify({"error": "Failed to join support group"}), 500
+        invalidate_access(child['_id'], user_uid)
+        return jsonify({
+            "message": "Successfully joined support group",
+            "child_name": child['name']
+        }), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -73,31 +63,36 @@ def get_support_group_members(child_id):
         # Get user information
         user_uid = request.user['uid']
         
-        # Find child and verify access
-        child = child_collection.find_one({
-            "_id": ObjectId(child_id),
-            "$or": [
-                {"parent_uid": user_uid},
-                {"support_group_id": {"$exists": True}}
-            ]
-        })
+        # Find child and verify the user is its parent or a support group member
+        access = get_access(user_uid, child_id)
         
+        if not has_access(access, (PARENT, MEMBER)):
+            return jsonify({"error": "Child not found or access denied"}), 404
+        child = child_collection.find_one({"_id": ObjectId(child_id)}, {"name": 1, "support_code": 1})
         if not child:
             return jsonify({"error": "Child not found or access denied"}), 404
             
-        # Get support group members
-        support_group = support_group_collection.find_one({
-            "_id": ObjectId(child['support_group_id']),
-            "members.uid": user_uid
-        })
-        
-        if not support_group:
+        # Get one page of support group members, ?limit=&next=&fields=uid,name,role,joined_at
+        try:
+            limit = int(request.args.get("limit", MEMBER_PAGE_SIZE))
+            fields = parse_fields(request.args.get("fields"))
+            members, next_cursor = list_members(
+                access['support_group_id'],
+                limit=limit,
+                cursor=request.args.get("next"),
+                fields=fields
+            )
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+        
+        if members is None:
             return jsonify({"error": "Support group not found or access denied"}), 404
             
         return jsonify({
             "child_name": child['name'],
             "support_code": child['support_code'],
-            "members": support_group['members']
+            "members": members,
+            "next": next_cursor
         }), 200
         
     except Exception as e:
@@ -119,25 +114,12 @@ def update_member_name(child_id, member_uid):
             return jsonify({"error": "You can only update your own name"}), 403
             
         # Find child and verify member access
-        child = child_collection.find_one({"_id": ObjectId(child_id)})
-        if not child:
+        support_group_id = get_access(user_uid, child_id)["support_group_id"]
+        if not support_group_id:
             return jsonify({"error": "Child not found"}), 404
             
         # Update member name
-        result = support_group_collection.update_one(
-            {
-                "_id": ObjectId(child['support_group_id']),
-                "members.uid": member_uid
-            },
-            {
-                "$set": {
-                    "members.$.name": data['name'],
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
-        
-        if result.modified_count:
+        if update_member(support_group_id, member_uid, {"name": data['name']}):
             return jsonify({"message": "Name updated successfully"}), 200
         return jsonify({"error": "Member not found"}), 404
         
@@ -156,29 +138,14 @@ def update_member_role(child_id, member_uid):
         parent_uid = request.user['uid']
         
         # Verify parent access
-        child = child_collection.find_one({
-            "_id": ObjectId(child_id),
-            "parent_uid": parent_uid
-        })
+        access = get_access(parent_uid, child_id)
         
-        if not child:
+        if not has_access(access):
             return jsonify({"error": "Child not found or access denied"}), 404
             
         # Update member role
-        result = support_group_collection.update_one(
-            {
-                "_id": ObjectId(child['support_group_id']),
-                "members.uid": member_uid
-            },
-            {
-                "$set": {
-                    "members.$.role": data['role'],
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
-        
-        if result.modified_count:
+        if update_member(access['support_group_id'], member_uid, {"role": data['role']}):
+            invalidate_access(child_id, member_uid)
             return jsonify({"message": "Member role updated successfully"}), 200
         return jsonify({"error": "Member not found"}), 404
         
@@ -193,24 +160,14 @@ def remove_member(child_id, member_uid):
         parent_uid = request.user['uid']
         
         # Verify parent access
-        child = child_collection.find_one({
-            "_id": ObjectId(child_id),
-            "parent_uid": parent_uid
-        })
+        access = get_access(parent_uid, child_id)
         
-        if not child:
+        if not has_access(access):
             return jsonify({"error": "Child not found or access denied"}), 404
             
         # Remove member from support group
-        result = support_group_collection.update_one(
-            {"_id": ObjectId(child['support_group_id'])},
-            {
-                "$pull": {"members": {"uid": member_uid}},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
-        
-        if result.modified_count:
+        if remove_group_member(access['support_group_id'], member_uid):
+            invalidate_access(child_id, member_uid)
             return jsonify({"message": "Member removed successfully"}), 200
         return jsonify({"error": "Member not found"}), 404
         
@@ -225,22 +182,23 @@ def regenerate_code(child_id):
         parent_uid = request.user['uid']
         
         # Verify parent access
-        child = child_collection.find_one({
-            "_id": ObjectId(child_id),
-            "parent_uid": parent_uid
-        })
+        access = get_access(parent_uid, child_id)
         
-        if not child:
+        if not has_access(access):
             return jsonify({"error": "Child not found or access denied"}), 404
             
-        # Generate new code
-        new_code = generate_new_code()
-        
-        # Update code in child document
-        result = child_collection.update_one(
-            {"_id": ObjectId(child_id)},
-            {"$set": {"support_code": new_code}}
-        )
+        # Generate new code and update it in the child document
+        for attempt in range(SUPPORT_CODE_ATTEMPTS):
+            new_code = generate_new_code()
+            try:
+                result = child_collection.update_one(
+                    {"_id": ObjectId(child_id)},
+                    {"$set": {"support_code": new_code}}
+                )
+                break
+            except DuplicateKeyError:
+                if attempt == SUPPORT_CODE_ATTEMPTS - 1:
+                    raise
         
         if result.modified_count:
             return jsonify({
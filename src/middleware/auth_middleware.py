@@ -2,7 +2,12 @@ from functools import wraps
 from flask import request, jsonify
 from src.config.firebase import verify_token
 
-def token_required(f):
+def token_required(f=None, check_revoked=False):
+    # Supports both @token_required and @token_required(check_revoked=True)
+    # for revocation-sensitive routes that must bypass the verified-token cache
+    if f is None:
+        return lambda func: token_required(func, check_revoked=check_revoked)
+
     @wraps(f)
     def decorated(*args, **kwargs):
         token = None
@@ -20,7 +25,7 @@ def token_required(f):
 
         try:
             # Verify the token
-            current_user = verify_token(token)
+            current_user = verify_token(token, check_revoked=check_revoked)
             if not current_user:
                 return jsonify({'message': 'Token is invalid!'}), 401
             
@@ -0,0 +1,75 @@
+from src.config.mongodb import get_collection
+from src.service.support_group_members import get_member
+from cachetools import TTLCache
+from bson import ObjectId
+from flask import g, has_request_context
+from dotenv import load_dotenv
+import threading
+import os
+
+load_dotenv()
+
+child_collection = get_collection('child')
+
+# Access cache settings, kept short since other workers only see invalidations after the TTL
+ACCESS_CACHE_TTL = int(os.getenv("ACCESS_CACHE_TTL", "30"))
+ACCESS_CACHE_SIZE = int(os.getenv("ACCESS_CACHE_SIZE", "10000"))
+
+# Relationship of a user to a child
+PARENT = "parent"
+MEMBER = "member"
+NONE = "none"
+
+# {"relation", "role", "support_group_id"} keyed by (child_id, uid). Only what authorization needs is
+# cached; callers read the child document itself fresh, since other workers may have changed it.
+access_cache = TTLCache(maxsize=ACCESS_CACHE_SIZE, ttl=ACCESS_CACHE_TTL)
+access_cache_lock = threading.Lock()
+
+def resolve_access(uid, child_id):
+    child = child_collection.find_one({"_id": ObjectId(child_id)}, {"parent_uid": 1, "support_group_id": 1})
+    if not child:
+        return {"relation": NONE, "role": None, "support_group_id": None}
+    support_group_id = child.get("support_group_id")
+    if child.get("parent_uid") == uid:
+        return {"relation": PARENT, "role": "parent", "support_group_id": support_group_id}
+
+    member = get_member(support_group_id, uid) if support_group_id else None
+    if not member:
+        return {"relation": NONE, "role": None, "support_group_id": support_group_id}
+    return {"relation": MEMBER, "role": member.get("role"), "support_group_id": support_group_id}
+
+def get_access(uid, child_id):
+    key = (str(child_id), uid)
+
+    # Request-scoped first, so repeated checks within one request never leave the process
+    request_cache = None
+    if has_request_context():
+        request_cache = g.setdefault("access_cache", {})
+        if key in request_cache:
+            return request_cache[key]
+
+    with access_cache_lock:
+        access = access_cache.get(key)
+    if access is None:
+        access = resolve_access(uid, child_id)
+        with access_cache_lock:
+            access_cache[key] = access
+
+    if request_cache is not None:
+        request_cache[key] = access
+    return access
+
+def has_access(access, relations=(PARENT,)):
+    return access["relation"] in relations
+
+def invalidate_access(child_id, uid=None):
+    # Called whenever ownership, membership, roles or the child's support group change
+    child_id = str(child_id)
+    with access_cache_lock:
+        for key in list(access_cache.keys()):
+            if key[0] == child_id and (uid is None or key[1] == uid):
+                access_cache.pop(key, None)
+    if has_request_context() and "access_cache" in g:
+        for key in list(g.access_cache):
+            if key[0] == child_id and (uid is None or key[1] == uid):
+                g.access_cache.pop(key, None)
@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+import threading
+import asyncio
+import logging
+import time
+import os
+
+load_dotenv()
+
+# Asynchronous chat job settings
+CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", "4"))
+CHAT_JOB_MAX_QUEUE = int(os.getenv("CHAT_JOB_MAX_QUEUE", "100"))
+CHAT_JOB_MAX_ATTEMPTS = int(os.getenv("CHAT_JOB_MAX_ATTEMPTS", "3"))
+CHAT_JOB_RETRY_DELAY = float(os.getenv("CHAT_JOB_RETRY_DELAY", "1"))  # seconds, doubled on each retry
+CHAT_JOB_STALE_AFTER = int(os.getenv("CHAT_JOB_STALE_AFTER", "300"))  # seconds without progress before recovery
+CHAT_JOB_RECOVER_INTERVAL = int(os.getenv("CHAT_JOB_RECOVER_INTERVAL", "60"))  # seconds between recovery sweeps
+
+# Lifecycle of a chat document created in async mode
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_COMPLETED = "completed"
+STATUS_DEAD_LETTER = "dead_letter"
+
+class ChatQueueFullError(Exception):
+    pass
+
+class ChatJobQueue:
+    def __init__(self, collection, handler, workers=CHAT_JOB_WORKERS, max_queue=CHAT_JOB_MAX_QUEUE,
+                 max_attempts=CHAT_JOB_MAX_ATTEMPTS, retry_delay=CHAT_JOB_RETRY_DELAY):
+        # handler(chat) returns the response text and raises on failure
+        self.collection = collection
+        self.handler = handler
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-job")
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.waiters = {}  # chat_id -> callbacks run once the job finishes in this process
+        self.stopped = threading.Event()
+        self.recovery_thread = None
+        self.stats = {"submitted": 0, "completed": 0, "retried": 0, "dead_lettered": 0, "rejected": 0, "recovered": 0}
+
+    def submit(self, chat_data):
+        with self.lock:
+            if self.outstanding >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise ChatQueueFullError("Chat queue is full, please try again later")
+            self.outstanding += 1
+
+        try:
+            chat_data["status"] = STATUS_PENDING
+            chat_data["attempts"] = 0
+            chat_data["updated_at"] = datetime.now()
+            chat_id = self.collection.insert_one(chat_data).inserted_id
+        except Exception:
+            with self.lock:
+                self.outstanding -= 1
+            raise
+
+        with self.lock:
+            self.waiters[chat_id] = []
+            self.stats["submitted"] += 1
+        self.executor.submit(self.run, chat_data)
+        return chat_id
+
+    def recover(self, stale_after=CHAT_JOB_STALE_AFTER):
+        # Jobs left pending or processing by a worker that died are claimed one at a time, so
+        # concurrently starting workers never pick up the same job twice
+        cutoff = datetime.now() - timedelta(seconds=stale_after)
+        recovered = 0
+        while True:
+            chat = self.collection.find_one_and_update(
+                {
+                    "status": {"$in": [STATUS_PENDING, STATUS_PROCESSING]},
+                    "$or": [
+                        {"updated_at": {"$lt": cutoff}},
+                        {"updated_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+                    ]
+                },
+                {"$set": {"status": STATUS_PENDING, "updated_at": datetime.now()}},
+                return_document=ReturnDocument.AFTER
+            )
+            if chat is None:
+                break
+            with self.lock:
+                self.outstanding += 1
+                self.waiters[chat["_id"]] = []
+            self.executor.submit(self.run, chat)
+            recovered += 1
+        if recovered:
+            logging.info(f"Recovered {recovered} stale chat jobs")
+        with self.lock:
+            self.stats["recovered"] += recovered
+        return recovered
+
+    def heartbeat(self):
+        # Jobs this process still owns, queued or running, are touched so other workers never
+        # mistake them for orphans
+        with self.lock:
+            chat_ids = list(self.waiters)
+        if chat_ids:
+            self.collection.update_many(
+                {"_id": {"$in": chat_ids}, "status": {"$in": [STATUS_PENDING, STATUS_PROCESSING]}},
+                {"$set": {"updated_at": datetime.now()}}
+            )
+
+    def start_recovery(self, interval=CHAT_JOB_RECOVER_INTERVAL, stale_after=CHAT_JOB_STALE_AFTER):
+        # A worker restarted after a crash comes up well within stale_after, so a sweep at startup
+        # alone would miss the jobs it left behind; every worker sweeps on an interval instead
+        def sweep():
+            while True:
+                try:
+                    self.heartbeat()
+                    self.recover(stale_after)
+                except Exception as e:
+                    logging.error(f"Error recovering chat jobs: {str(e)}")
+                if self.stopped.wait(interval):
+                    return
+
+        self.recovery_thread = threading.Thread(target=sweep, name="chat-job-recovery", daemon=True)
+        self.recovery_thread.start()
+
+    def set_status(self, chat_id, fields, unset=None):
+        update = {"$set": {**fields, "updated_at": datetime.now()}}
+        if unset:
+            update["$unset"] = {field: "" for field in unset}
+        self.collection.update_one({"_id": chat_id}, update)
+
+    def run(self, chat):
+        chat_id = chat["_id"]
+        last_error = chat.get("error")
+        try:
+            # Recovered jobs continue from the attempts already spent on them
+            for attempt in range(chat.get("attempts", 0) + 1, self.max_attempts + 1):
+                try:
+                    self.set_status(chat_id, {"status": STATUS_PROCESSING, "attempts": attempt})
+                    response = self.handler(chat)
+                    self.set_status(chat_id, {"status": STATUS_COMPLETED, "response": response}, unset=["error"])
+                    with self.lock:
+                        self.stats["completed"] += 1
+                    return
+                except Exception as e:
+                    last_error = str(e)
+                    logging.error(f"Chat job {chat_id} attempt {attempt} failed: {last_error}")
+                    if attempt < self.max_attempts:
+                        with self.lock:
+                            self.stats["retried"] += 1
+                        time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+            # Out of attempts, park the job so it can be inspected or replayed
+            self.set_status(chat_id, {"status": STATUS_DEAD_LETTER, "error": last_error})
+            with self.lock:
+                self.stats["dead_lettered"] += 1
+        except Exception as e:
+            logging.error(f"Error updating chat job {chat_id}: {str(e)}")
+        finally:
+            with self.lock:
+                self.outstanding -= 1
+                callbacks = self.waiters.pop(chat_id, [])
+            for callback in callbacks:
+                callback()
+
+    async def wait(self, chat_id, timeout):
+        # Returns False when the job is not owned by this process and the caller must poll.
+        # Awaiting never blocks the event loop; the job thread resolves the future when it finishes.
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(True))
+
+        with self.lock:
+            callbacks = self.waiters.get(chat_id)
+            if callbacks is None:
+                return False
+            callbacks.append(notify)
+        try:
+            await asyncio.wait_for(finished, timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                if notify in self.waiters.get(chat_id, []):
+                    self.waiters[chat_id].remove(notify)
+        return True
+
+    def shutdown(self):
+        # Lets queued and running jobs finish so no pending chat is left behind
+        self.stopped.set()
+        self.executor.shutdown(wait=True)
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "outstanding": self.outstanding, "max_queue": self.max_queue}
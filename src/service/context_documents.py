@@ -0,0 +1,84 @@
+from dotenv import load_dotenv
+from src.config import storage
+from src.service import knowledge_base_files
+from src.service.knowledge_index import extract_text
+import threading
+import logging
+import time
+import os
+
+load_dotenv()
+
+# Context document settings; the local file is used for children without a flagged diagnosis file
+CONTEXT_DOCUMENT_NAME = os.getenv("CONTEXT_DOCUMENT_NAME", "diagnosis.md")
+CONTEXT_DOCUMENT_PATH = os.getenv(
+    "CONTEXT_DOCUMENT_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), CONTEXT_DOCUMENT_NAME)
+)
+CONTEXT_DOCUMENTS_FROM_BUCKET = os.getenv("CONTEXT_DOCUMENTS_FROM_BUCKET", "true").lower() == "true"
+CONTEXT_DOCUMENT_REVALIDATE = int(os.getenv("CONTEXT_DOCUMENT_REVALIDATE", "60"))  # seconds between record checks
+
+# Loaded documents keyed by local path or "child:<child_id>": {"content", "version", "checked_at"}
+documents = {}
+documents_lock = threading.Lock()
+
+def store(key, content, version):
+    document = {"content": content, "version": version, "checked_at": time.monotonic()}
+    with documents_lock:
+        documents[key] = document
+    return document
+
+def load_local_document(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    # Re-read only when the file changed on disk
+    version = f"file:{stat.st_mtime_ns}:{stat.st_size}"
+    cached = documents.get(path)
+    if cached and cached["version"] == version:
+        return cached
+
+    with open(path, "r", encoding="utf-8") as file:
+        return store(path, file.read(), version)
+
+def load_bucket_document(child_id):
+    # The child's uploaded file flagged as the diagnosis; the record is rechecked every
+    # CONTEXT_DOCUMENT_REVALIDATE seconds and the object only re-read when its version changes
+    key = f"child:{child_id}"
+    cached = documents.get(key)
+    if cached and time.monotonic() - cached["checked_at"] < CONTEXT_DOCUMENT_REVALIDATE:
+        return cached
+
+    record = knowledge_base_files.get_diagnosis_file(child_id)
+    if record is None:
+        # Remember the miss too so children without a document do not hit MongoDB on every chat
+        return store(key, None, None)
+
+    version = f"kb:{record.get('hash') or record.get('etag') or record['key']}"
+    if cached and cached["version"] == version:
+        cached["checked_at"] = time.monotonic()
+        return cached
+
+    data = storage.get_object(record["key"])['Body'].read()
+    return store(key, extract_text(data, record.get("original_name") or record["filename"]), version)
+
+def get_context_document(child_id=None):
+    # Per-child diagnosis file from the knowledge base, falling back to the shared local file
+    if child_id and CONTEXT_DOCUMENTS_FROM_BUCKET and storage.BUCKET_NAME:
+        try:
+            document = load_bucket_document(child_id)
+            if document["content"] is not None:
+                return document
+        except Exception as e:
+            logging.error(f"Error loading context document for child {child_id}: {str(e)}")
+            cached = documents.get(f"child:{child_id}")
+            if cached and cached["content"] is not None:
+                return cached
+    return load_local_document(CONTEXT_DOCUMENT_PATH)
+
+def invalidate_context_document(child_id=None):
+    key = f"child:{child_id}" if child_id else CONTEXT_DOCUMENT_PATH
+    with documents_lock:
+        documents.pop(key, None)
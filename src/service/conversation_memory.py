@@ -0,0 +1,159 @@
+from src.config.mongodb import get_collection
+from src.config.gemini import submit_to_gemini_pool, generate_text, estimate_tokens
+from src.config.async_mongodb import blocking_executor
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+from dotenv import load_dotenv
+import threading
+import hashlib
+import logging
+import os
+
+load_dotenv()
+
+chat_collection = get_collection('chat')
+memory_collection = get_collection('chat_memory')
+
+# Conversation memory settings
+CONVERSATION_MEMORY_ENABLED = os.getenv("CONVERSATION_MEMORY_ENABLED", "true").lower() == "true"
+CHAT_MEMORY_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", "6"))  # latest turns kept verbatim
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+CHAT_SUMMARY_BATCH = int(os.getenv("CHAT_SUMMARY_BATCH", "4"))  # older turns folded into the summary at once
+CHAT_SUMMARY_MAX_BATCH = int(os.getenv("CHAT_SUMMARY_MAX_BATCH", "20"))
+
+# Children whose summary is currently being refreshed in the background
+refreshing = set()
+refreshing_lock = threading.Lock()
+
+def format_turn(turn):
+    return f"Caregiver: {turn['question']}\nPsychologist: {turn.get('response', '')}"
+
+def recent_turns(child_id):
+    turns = chat_collection.find(
+        {"child_id": child_id, "response": {"$exists": True}},
+        {"question": 1, "response": 1, "created_at": 1}
+    ).sort("created_at", -1).limit(CHAT_MEMORY_TURNS)
+    return list(reversed(list(turns)))
+
+def build_conversation_context(child_id):
+    # Latest turns verbatim plus the rolling summary, trimmed to the token budget
+    if not CONVERSATION_MEMORY_ENABLED:
+        return None
+
+    memory = memory_collection.find_one({"_id": child_id}, {"summary": 1}) or {}
+    turns = [format_turn(turn) for turn in recent_turns(child_id)]
+
+    # Newest turns take priority over older ones and over the summary
+    kept_turns = []
+    used_tokens = 0
+    for text in reversed(turns):
+        tokens = estimate_tokens(text)
+        if used_tokens + tokens > CHAT_HISTORY_TOKEN_BUDGET:
+            break
+        kept_turns.insert(0, text)
+        used_tokens += tokens
+
+    summary = memory.get("summary", "")
+    remaining_tokens = CHAT_HISTORY_TOKEN_BUDGET - used_tokens
+    if summary and remaining_tokens > 0:
+        summary = summary[:remaining_tokens * 4]
+    else:
+        summary = ""
+
+    if not summary and not kept_turns:
+        return None
+
+    sections = []
+    if summary:
+        sections.append(f"Summary of the earlier conversation:\n{summary}")
+    if kept_turns:
+        sections.append("Most recent conversation:\n" + "\n\n".join(kept_turns))
+    text = "\n\n".join(sections)
+    return {
+        "text": text,
+        "tokens": estimate_tokens(text),
+        "version": hashlib.sha256(text.encode("utf-8")).hexdigest()
+    }
+
+def build_summary_prompt(summary, turns):
+    conversation = "\n\n".join(format_turn(turn) for turn in turns)
+    return f"""You keep running notes of a consultation between a clinical psychologist and the caregivers of a child with ASD.
+    Update the existing notes with the new exchanges below. Keep every fact about the child, the concerns raised and the advice given.
+    Answer with the updated notes only, in at most 300 words.
+
+    Existing notes:
+    {summary or "(none yet)"}
+
+    New exchanges:
+    {conversation}"""
+
+def finish_refresh(child_id):
+    with refreshing_lock:
+        refreshing.discard(child_id)
+
+def check_summary(child_id):
+    # Runs on the blocking pool: the reads decide whether a batch is due, and only then is the
+    # summarization itself queued for a Gemini slot
+    try:
+        memory = memory_collection.find_one({"_id": child_id}) or {}
+        window = recent_turns(child_id)
+        if len(window) < CHAT_MEMORY_TURNS:
+            finish_refresh(child_id)
+            return
+
+        # Only turns that fell out of the verbatim window and are not summarized yet
+        created_at = {"$lt": window[0]["created_at"]}
+        if memory.get("summarized_until"):
+            created_at["$gt"] = memory["summarized_until"]
+        pending = list(chat_collection.find(
+            {"child_id": child_id, "response": {"$exists": True}, "created_at": created_at},
+            {"question": 1, "response": 1, "created_at": 1}
+        ).sort("created_at", 1).limit(CHAT_SUMMARY_MAX_BATCH))
+        if len(pending) < CHAT_SUMMARY_BATCH:
+            finish_refresh(child_id)
+            return
+
+        future = submit_to_gemini_pool(generate_text, build_summary_prompt(memory.get("summary"), pending))
+        future.add_done_callback(
+            lambda done: blocking_executor.submit(store_summary, child_id, memory.get("summarized_until"), pending, done)
+        )
+    except Exception as e:
+        logging.error(f"Error refreshing summary for child {child_id}: {str(e)}")
+        finish_refresh(child_id)
+
+def store_summary(child_id, summarized_until, pending, future):
+    try:
+        summary = future.result()
+
+        # Conditional on the previous watermark so concurrent refreshes cannot overwrite each other
+        memory_collection.update_one(
+            {"_id": child_id, "summarized_until": summarized_until},
+            {"$set": {
+                "summary": summary,
+                "summarized_until": pending[-1]["created_at"],
+                "updated_at": datetime.now()
+            }},
+            upsert=True
+        )
+        logging.info(f"Summarized {len(pending)} turns for child {child_id}")
+    except DuplicateKeyError:
+        logging.info(f"Summary for child {child_id} was refreshed concurrently")
+    except Exception as e:
+        logging.error(f"Error refreshing summary for child {child_id}: {str(e)}")
+    finally:
+        finish_refresh(child_id)
+
+def schedule_summary_refresh(child_id):
+    # Runs in the background so summarization never adds latency to the chat response; a Gemini
+    # slot is only taken once a batch of turns is actually due
+    if not CONVERSATION_MEMORY_ENABLED:
+        return
+    with refreshing_lock:
+        if child_id in refreshing:
+            return
+        refreshing.add(child_id)
+    try:
+        blocking_executor.submit(check_summary, child_id)
+    except RuntimeError:
+        # The pool is shut down while the worker exits
+        finish_refresh(child_id)
@@ -0,0 +1,195 @@
+from src.config.mongodb import get_collection
+from src.config import storage
+from src.service.knowledge_index import is_indexable
+from pymongo import UpdateOne, DESCENDING
+from bson import ObjectId
+from datetime import datetime
+from dotenv import load_dotenv
+from urllib.parse import unquote
+from werkzeug.utils import secure_filename
+import argparse
+import uuid
+import hashlib
+import base64
+import logging
+import re
+import os
+
+load_dotenv()
+
+files_collection = get_collection('knowledge_base_files')
+
+# File listing pagination
+FILES_PAGE_SIZE = int(os.getenv("KNOWLEDGE_BASE_FILES_PAGE_SIZE", "100"))
+FILES_MAX_PAGE_SIZE = int(os.getenv("KNOWLEDGE_BASE_FILES_MAX_PAGE_SIZE", "500"))
+FILES_PROJECTION = {
+    "key": 1, "filename": 1, "original_name": 1, "size": 1, "content_type": 1,
+    "hash": 1, "etag": 1, "uploaded_at": 1, "is_diagnosis": 1
+}
+
+def stored_filename(filename):
+    # Upload time for readability plus a random suffix, so files uploaded in the same second never collide
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = os.path.splitext(secure_filename(filename))[1]
+    return f"{timestamp}_{uuid.uuid4().hex}{extension}"
+
+def file_digest(file):
+    # sha256 and size of an uploaded file, leaving it rewound for the S3 upload
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+def prepare_upload(file, child_id):
+    # {"key", "file", ...} for storage.upload_batch, plus what file_record and the retrieval index need
+    new_filename = stored_filename(file.filename)
+
+    # Keep the bytes of text documents for the retrieval index
+    data = None
+    if is_indexable(file.filename):
+        data = file.read()
+        file.seek(0)
+    file_hash, size = file_digest(file)
+
+    return {
+        "key": f"{child_id}/{new_filename}",
+        "file": file,
+        "content_type": file.content_type,
+        "data": data,
+        "filename": new_filename,
+        "original_name": file.filename,
+        "hash": file_hash,
+        "size": size
+    }
+
+def file_record(child_id, key, original_name, size, content_type, file_hash=None, etag=None, uploaded_at=None):
+    return {
+        "child_id": str(child_id),
+        "key": key,
+        "filename": os.path.basename(key),
+        "original_name": original_name,
+        "size": size,
+        "content_type": content_type,
+        "hash": file_hash,
+        "etag": etag,
+        "uploaded_at": uploaded_at or datetime.utcnow()
+    }
+
+def record_files(records):
+    # Upsert by key, so retried uploads and reconciliation never duplicate a file
+    if records:
+        files_collection.bulk_write(
+            [UpdateOne({"key": record["key"]}, {"$set": record}, upsert=True) for record in records],
+            ordered=False
+        )
+
+def forget_files(keys):
+    keys = list(keys)
+    if keys:
+        files_collection.delete_many({"key": {"$in": keys}})
+
+def get_files(child_id, filenames):
+    # Records for the given stored filenames in the child's folder, through the unique key index
+    keys = [f"{child_id}/{filename}" for filename in filenames]
+    return list(files_collection.find({"key": {"$in": keys}}, FILES_PROJECTION))
+
+def get_diagnosis_file(child_id):
+    # The file a parent flagged as the child's diagnosis, used as the chat context document
+    return files_collection.find_one({"child_id": str(child_id), "is_diagnosis": True}, FILES_PROJECTION)
+
+def set_diagnosis_file(child_id, key=None):
+    # Flags one of the child's files, or none without a key; the partial unique index allows one flag per child
+    files_collection.update_many(
+        {"child_id": str(child_id), "is_diagnosis": True, "key": {"$ne": key}},
+        {"$unset": {"is_diagnosis": ""}}
+    )
+    if key is None:
+        return True
+    result = files_collection.update_one({"child_id": str(child_id), "key": key}, {"$set": {"is_diagnosis": True}})
+    return bool(result.matched_count)
+
+def encode_cursor(record):
+    raw = f"{record['uploaded_at'].isoformat()}|{record['_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    uploaded_at, record_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+    return datetime.fromisoformat(uploaded_at), ObjectId(record_id)
+
+def list_files(child_id, limit=FILES_PAGE_SIZE, cursor=None, content_type=None, uploaded_after=None,
+               uploaded_before=None):
+    # Newest first, keyset paginated on (uploaded_at, _id); content_type may be a prefix such as "image/"
+    limit = min(max(limit, 1), FILES_MAX_PAGE_SIZE)
+    query = {"child_id": str(child_id)}
+    if content_type:
+        if content_type.endswith("/"):
+            query["content_type"] = {"$regex": f"^{re.escape(content_type)}"}
+        else:
+            query["content_type"] = content_type
+
+    uploaded_at = {}
+    if uploaded_after:
+        uploaded_at["$gte"] = uploaded_after
+    if uploaded_before:
+        uploaded_at["$lt"] = uploaded_before
+    if uploaded_at:
+        query["uploaded_at"] = uploaded_at
+
+    if cursor:
+        last_uploaded_at, last_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"uploaded_at": {"$lt": last_uploaded_at}},
+            {"uploaded_at": last_uploaded_at, "_id": {"$lt": last_id}}
+        ]
+
+    records = list(files_collection.find(
+        query,
+        FILES_PROJECTION,
+        sort=[("uploaded_at", DESCENDING), ("_id", DESCENDING)],
+        limit=limit + 1
+    ))
+    has_more = len(records) > limit
+    records = records[:limit]
+    return records, encode_cursor(records[-1]) if has_more else None
+
+def reconcile(child_id=None):
+    # Resyncs the collection with the bucket: adds objects it is missing, drops records without an object
+    started_at = datetime.utcnow()
+    prefix = f"{child_id}/" if child_id else ""
+    objects = {
+        obj["Key"]: obj for obj in storage.list_objects(prefix)
+        if not obj["Key"].endswith("/") and ObjectId.is_valid(obj["Key"].split("/", 1)[0])
+    }
+    query = {"child_id": str(child_id)} if child_id else {}
+    known = {record["key"]: record for record in files_collection.find(query, {"key": 1, "uploaded_at": 1})}
+
+    missing = []
+    for key in objects.keys() - known.keys():
+        head = storage.head_object(key)
+        missing.append(file_record(
+            key.split("/", 1)[0],
+            key,
+            unquote(head.get("Metadata", {}).get("original-name", os.path.basename(key))),
+            head["ContentLength"],
+            head.get("ContentType"),
+            etag=head["ETag"].strip('"'),
+            uploaded_at=head["LastModified"].replace(tzinfo=None)
+        ))
+    record_files(missing)
+
+    # Records written while the bucket was being listed may not show up in the listing yet
+    stale = [key for key, record in known.items() if key not in objects and record["uploaded_at"] < started_at]
+    forget_files(stale)
+    logging.info(f"Reconciled knowledge base files: {len(missing)} added, {len(stale)} removed")
+    return {"added": len(missing), "removed": len(stale)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Resync the knowledge_base_files collection with the bucket")
+    parser.add_argument("--child", help="only reconcile this child's folder")
+    args = parser.parse_args()
+
+    result = reconcile(args.child)
+    print(f"Added {result['added']}, removed {result['removed']} file records")
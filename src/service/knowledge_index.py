@@ -0,0 +1,188 @@
+from src.config.mongodb import get_collection
+from src.config import storage
+from src.config.lifecycle import register_shutdown
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+import google.generativeai as genai
+import numpy as np
+import threading
+import hashlib
+import logging
+import time
+import io
+import os
+import re
+
+load_dotenv()
+
+chunk_collection = get_collection('knowledge_base_chunks')
+
+# Retrieval settings
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() == "true"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.2"))
+CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "200"))
+CHUNK_OVERLAP_WORDS = int(os.getenv("CHUNK_OVERLAP_WORDS", "40"))
+INDEX_CACHE_TTL = int(os.getenv("INDEX_CACHE_TTL", "300"))  # seconds before reloading from Mongo
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+
+INDEXABLE_EXTENSIONS = {'txt', 'md', 'pdf', 'docx'}
+
+# Ingestion runs off the request path
+ingest_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="kb-ingest")
+register_shutdown(lambda: ingest_executor.shutdown(wait=True))
+
+# Per-child index: {"matrix": normalized embeddings, "chunks": [{"key", "text"}], "loaded_at"}
+indexes = {}
+indexes_lock = threading.Lock()
+
+class GeminiEmbedder:
+    def embed(self, texts, task_type="retrieval_document"):
+        result = genai.embed_content(model=EMBEDDING_MODEL, content=texts, task_type=task_type)
+        return np.array(result["embedding"], dtype=np.float32)
+
+class HashingEmbedder:
+    # Deterministic bag-of-words embedder for tests and offline runs
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def embed(self, texts, task_type=None):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = hashlib.md5(word.encode("utf-8")).digest()
+                vectors[row, int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0
+        return vectors
+
+embedder = HashingEmbedder() if os.getenv("EMBEDDER", "gemini") == "hashing" else GeminiEmbedder()
+
+def set_embedder(new_embedder):
+    global embedder
+    embedder = new_embedder
+    with indexes_lock:
+        indexes.clear()
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def is_indexable(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in INDEXABLE_EXTENSIONS
+
+def extract_text(data, filename):
+    extension = filename.rsplit('.', 1)[1].lower()
+    if extension in ('txt', 'md'):
+        return data.decode("utf-8", errors="ignore")
+    if extension == 'pdf':
+        from pypdf import PdfReader
+        reader = PdfReader(io.BytesIO(data))
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    if extension == 'docx':
+        from docx import Document
+        document = Document(io.BytesIO(data))
+        return "\n".join(paragraph.text for paragraph in document.paragraphs)
+    return ""
+
+def chunk_text(text):
+    words = text.split()
+    step = max(CHUNK_WORDS - CHUNK_OVERLAP_WORDS, 1)
+    return [
+        " ".join(words[start:start + CHUNK_WORDS])
+        for start in range(0, len(words), step)
+        if words[start:start + CHUNK_WORDS]
+    ]
+
+def ingest_file(child_id, key, filename, data=None):
+    try:
+        if data is None:
+            # Direct uploads never pass through the API, so the bytes are fetched here on the ingest pool
+            data = storage.get_object(key)['Body'].read()
+        text = extract_text(data, filename)
+        chunks = chunk_text(text)
+        if not chunks:
+            logging.info(f"No text extracted from {key}")
+            return 0
+
+        embeddings = normalize(embedder.embed(chunks))
+        chunk_collection.delete_many({"child_id": child_id, "key": key})
+        chunk_collection.insert_many([
+            {
+                "child_id": child_id,
+                "key": key,
+                "position": position,
+                "text": chunk,
+                "embedding": embeddings[position].tolist(),
+                "created_at": datetime.now()
+            }
+            for position, chunk in enumerate(chunks)
+        ])
+        invalidate_index(child_id)
+        logging.info(f"Indexed {len(chunks)} chunks from {key}")
+        return len(chunks)
+    except Exception as e:
+        logging.error(f"Error indexing {key}: {str(e)}")
+        return 0
+
+def schedule_ingest(child_id, key, filename, data=None):
+    if RETRIEVAL_ENABLED and is_indexable(filename):
+        return ingest_executor.submit(ingest_file, child_id, key, filename, data)
+    return None
+
+def remove_file(child_id, key):
+    chunk_collection.delete_many({"child_id": child_id, "key": key})
+    invalidate_index(child_id)
+
+def invalidate_index(child_id):
+    with indexes_lock:
+        indexes.pop(child_id, None)
+
+def load_index(child_id):
+    cached = indexes.get(child_id)
+    if cached and time.monotonic() - cached["loaded_at"] < INDEX_CACHE_TTL:
+        return cached
+
+    rows = list(chunk_collection.find(
+        {"child_id": child_id},
+        {"key": 1, "text": 1, "embedding": 1}
+    ).sort([("key", 1), ("position", 1)]))
+    index = {
+        "matrix": np.array([row["embedding"] for row in rows], dtype=np.float32) if rows else None,
+        "chunks": [{"id": str(row["_id"]), "key": row["key"], "text": row["text"]} for row in rows],
+        "loaded_at": time.monotonic()
+    }
+    with indexes_lock:
+        indexes[child_id] = index
+    return index
+
+def search(child_id, query, top_k=RETRIEVAL_TOP_K):
+    index = load_index(child_id)
+    if index["matrix"] is None:
+        return []
+
+    # Rows are stored normalized, so the dot product is the cosine similarity
+    query_vector = normalize(embedder.embed([query], task_type="retrieval_query"))[0]
+    scores = index["matrix"] @ query_vector
+    top = np.argsort(-scores)[:top_k]
+    return [
+        {**index["chunks"][position], "score": float(scores[position])}
+        for position in top
+        if scores[position] >= RETRIEVAL_MIN_SCORE
+    ]
+
+def retrieve_knowledge(child_id, question):
+    # Compact prompt section with only the most relevant chunks, or None
+    if not RETRIEVAL_ENABLED:
+        return None
+    try:
+        results = search(child_id, question)
+    except Exception as e:
+        logging.error(f"Error searching knowledge base for child {child_id}: {str(e)}")
+        return None
+    if not results:
+        return None
+
+    text = "\n\n".join(result["text"] for result in results)
+    version = hashlib.sha256(",".join(result["id"] for result in results).encode("utf-8")).hexdigest()
+    return {"text": text, "version": version}
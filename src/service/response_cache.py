@@ -0,0 +1,145 @@
+from cachetools import TTLCache
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import threading
+import hashlib
+import logging
+import re
+import os
+
+load_dotenv()
+
+# Response cache settings
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory, mongo or off
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # seconds
+
+def normalize_question(question):
+    # "How do I handle meltdowns at bedtime?" and "how do i handle  meltdowns at bedtime" share an entry
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+def make_cache_key(question, first_message=False, context_version=None):
+    variant = f"{int(bool(first_message))}|{context_version or ''}|{normalize_question(question)}"
+    return hashlib.sha256(variant.encode("utf-8")).hexdigest()
+
+class MemoryBackend:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        # TTLCache evicts the least recently used entry once maxsize is reached
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key, response):
+        with self.lock:
+            self.entries[key] = response
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def size(self):
+        with self.lock:
+            return len(self.entries)
+
+class MongoBackend:
+    def __init__(self, collection, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        # Shared across workers; expired entries are removed by the TTL index on expires_at, which
+        # src/config/indexes.py declares with the last_hit_at index used for eviction
+        self.collection = collection
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    def get(self, key):
+        now = datetime.utcnow()
+        # Bump last_hit_at in the same round trip so eviction stays LRU
+        entry = self.collection.find_one_and_update(
+            {"_id": key, "expires_at": {"$gt": now}},
+            {"$set": {"last_hit_at": now}},
+            projection={"response": 1}
+        )
+        return entry["response"] if entry else None
+
+    def set(self, key, response):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": key},
+            {"$set": {
+                "response": response,
+                "created_at": now,
+                "last_hit_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl)
+            }},
+            upsert=True
+        )
+        self.evict()
+
+    def evict(self):
+        overflow = self.collection.estimated_document_count() - self.maxsize
+        if overflow > 0:
+            stale = self.collection.find({}, {"_id": 1}).sort("last_hit_at", 1).limit(overflow)
+            self.collection.delete_many({"_id": {"$in": [entry["_id"] for entry in stale]}})
+
+    def clear(self):
+        self.collection.delete_many({})
+
+    def size(self):
+        return self.collection.estimated_document_count()
+
+def create_backend(name=RESPONSE_CACHE_BACKEND):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "mongo":
+        from src.config.mongodb import get_collection
+        return MongoBackend(get_collection('chat_response_cache'))
+    return None
+
+backend = create_backend()
+stats_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "errors": 0}
+
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
+
+def count(stat):
+    with stats_lock:
+        stats[stat] += 1
+
+def get_cached_response(question, first_message=False, context_version=None):
+    if backend is None:
+        return None
+    try:
+        response = backend.get(make_cache_key(question, first_message, context_version))
+    except Exception as e:
+        # A cache failure must never fail the chat request
+        logging.error(f"Error reading response cache: {str(e)}")
+        count("errors")
+        return None
+    count("hits" if response is not None else "misses")
+    return response
+
+def bypass_cache():
+    # Requests that skip the cache on purpose, so the hit rate only covers cacheable prompts
+    if backend is not None:
+        count("bypassed")
+
+def cache_response(question, response, first_message=False, context_version=None):
+    if backend is None:
+        return
+    try:
+        backend.set(make_cache_key(question, first_message, context_version), response)
+        count("stores")
+    except Exception as e:
+        logging.error(f"Error writing response cache: {str(e)}")
+        count("errors")
+
+def get_response_cache_stats():
+    with stats_lock:
+        lookups = stats["hits"] + stats["misses"]
+        result = {**stats, "hit_rate": stats["hits"] / lookups if lookups else 0.0}
+    result["backend"] = type(backend).__name__ if backend is not None else None
+    return result
@@ -0,0 +1,159 @@
+from src.config import storage
+from src.config.mongodb import get_collection
+from pymongo.errors import DuplicateKeyError
+from cachetools import TLRUCache
+from datetime import datetime
+from dotenv import load_dotenv
+import threading
+import logging
+import time
+import os
+
+load_dotenv()
+
+# Presigned URL settings
+SIGNED_URL_EXPIRY = int(os.getenv("SIGNED_URL_EXPIRY", "3600"))
+SIGNED_URL_REFRESH_MARGIN = int(os.getenv("SIGNED_URL_REFRESH_MARGIN", "300"))  # re-sign this long before expiry
+SIGNED_URL_CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE", "10000"))
+SIGNED_URL_BACKEND = os.getenv("SIGNED_URL_BACKEND", "memory")  # memory (per worker) or mongo (shared)
+
+# {"url", "expires_at"} keyed by (object key, version); an entry is dropped once it is close to expiry,
+# so clients keep receiving the same URL, and browsers and CDNs can cache it, until then. With the
+# memory backend every worker signs its own URL for the same file.
+signed_url_cache = TLRUCache(
+    maxsize=SIGNED_URL_CACHE_SIZE,
+    ttu=lambda key, entry, now: entry["expires_at"] - SIGNED_URL_REFRESH_MARGIN,
+    timer=time.time
+)
+signed_url_lock = threading.Lock()
+signed_url_stats = {"hits": 0, "shared_hits": 0, "misses": 0, "errors": 0}
+
+# With the mongo backend the local cache sits in front of signed_urls, which every worker shares;
+# documents are removed by a TTL index on refresh_at
+signed_url_collection = get_collection('signed_urls')
+
+def uses_shared_cache():
+    return SIGNED_URL_BACKEND == "mongo"
+
+def file_version(record):
+    # Content hash when known, otherwise the ETag or upload time, so a replaced object gets a new URL
+    version = record.get("hash") or record.get("etag") or record.get("uploaded_at")
+    return version.isoformat() if hasattr(version, "isoformat") else version
+
+def shared_id(cache_key):
+    key, version = cache_key
+    return f"{key}|{version or ''}"
+
+def count(stat, amount=1):
+    with signed_url_lock:
+        signed_url_stats[stat] += amount
+
+def load_shared(cache_keys):
+    # Entries other workers signed that are not close to expiry yet, in one round trip
+    ids = {shared_id(cache_key): cache_key for cache_key in cache_keys}
+    documents = signed_url_collection.find(
+        {"_id": {"$in": list(ids)}, "refresh_at": {"$gt": datetime.utcnow()}},
+        {"url": 1, "expires_at": 1}
+    )
+    return {ids[document["_id"]]: {"url": document["url"], "expires_at": document["expires_at"]} for document in documents}
+
+def store_shared(cache_key, entry):
+    # The first fresh entry wins, so workers that signed the same file at once converge on one URL
+    now = datetime.utcnow()
+    document = {
+        "_id": shared_id(cache_key),
+        "key": cache_key[0],
+        "url": entry["url"],
+        "expires_at": entry["expires_at"],
+        "refresh_at": datetime.utcfromtimestamp(entry["expires_at"] - SIGNED_URL_REFRESH_MARGIN)
+    }
+    try:
+        signed_url_collection.insert_one(document)
+        return entry
+    except DuplicateKeyError:
+        pass
+
+    # Replace the existing entry only when it is past its refresh time and the TTL monitor has not removed it yet
+    replaced = signed_url_collection.find_one_and_update(
+        {"_id": document["_id"], "refresh_at": {"$lte": now}},
+        {"$set": document}
+    )
+    if replaced is not None:
+        return entry
+    existing = signed_url_collection.find_one({"_id": document["_id"]}, {"url": 1, "expires_at": 1})
+    return {"url": existing["url"], "expires_at": existing["expires_at"]} if existing else entry
+
+def sign(cache_keys):
+    # {(key, version): {"url", "expires_at"}} through the local cache, then the shared one, then S3 signing
+    entries = {}
+    missing = []
+    with signed_url_lock:
+        for cache_key in cache_keys:
+            entry = signed_url_cache.get(cache_key)
+            if entry is not None:
+                signed_url_stats["hits"] += 1
+                entries[cache_key] = entry
+            else:
+                missing.append(cache_key)
+    if not missing:
+        return entries
+
+    found = {}
+    if uses_shared_cache():
+        try:
+            found = load_shared(missing)
+            count("shared_hits", len(found))
+        except Exception as e:
+            # A cache failure must never fail the listing, the URLs are signed locally instead
+            logging.error(f"Error reading shared signed URL cache: {str(e)}")
+            count("errors")
+
+    for cache_key in missing:
+        if cache_key in found:
+            continue
+        count("misses")
+        expires_at = int(time.time()) + SIGNED_URL_EXPIRY
+        entry = {"url": storage.generate_presigned_url(cache_key[0], expires_in=SIGNED_URL_EXPIRY), "expires_at": expires_at}
+        if uses_shared_cache():
+            try:
+                entry = store_shared(cache_key, entry)
+            except Exception as e:
+                logging.error(f"Error writing shared signed URL cache: {str(e)}")
+                count("errors")
+        found[cache_key] = entry
+
+    with signed_url_lock:
+        for cache_key, entry in found.items():
+            signed_url_cache[cache_key] = entry
+    entries.update(found)
+    return entries
+
+def get_signed_url(key, version=None):
+    return sign([(key, version)])[(key, version)]
+
+def sign_files(records):
+    cache_keys = [(record["key"], file_version(record)) for record in records]
+    entries = sign(cache_keys)
+    return {cache_key[0]: entries[cache_key] for cache_key in cache_keys}
+
+def invalidate_signed_url(key):
+    # Other workers keep their local copy until it is close to expiry
+    with signed_url_lock:
+        for cache_key in list(signed_url_cache.keys()):
+            if cache_key[0] == key:
+                signed_url_cache.pop(cache_key, None)
+    if uses_shared_cache():
+        try:
+            signed_url_collection.delete_many({"key": key})
+        except Exception as e:
+            logging.error(f"Error invalidating shared signed URL cache: {str(e)}")
+
+def get_signed_url_stats():
+    with signed_url_lock:
+        total = signed_url_stats["hits"] + signed_url_stats["shared_hits"] + signed_url_stats["misses"]
+        return {
+            **signed_url_stats,
+            "backend": SIGNED_URL_BACKEND,
+            "size": len(signed_url_cache),
+            "hit_rate": (signed_url_stats["hits"] + signed_url_stats["shared_hits"]) / total if total else 0.0
+        }
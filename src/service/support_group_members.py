@@ -0,0 +1,258 @@
+from src.config.mongodb import get_collection
+from pymongo import ASCENDING, UpdateOne, DeleteMany
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from datetime import datetime
+from dotenv import load_dotenv
+import argparse
+import base64
+import json
+import os
+
+load_dotenv()
+
+support_group_collection = get_collection('support_group')
+member_collection = get_collection('support_group_members')
+
+# "embedded" keeps members in the support_group document, "collection" stores one
+# document per member in support_group_members so large groups never rewrite a growing array
+MEMBER_STORAGE = os.getenv("SUPPORT_GROUP_MEMBER_STORAGE", "embedded").lower()
+
+# Member listing pagination
+MEMBER_PAGE_SIZE = int(os.getenv("MEMBER_PAGE_SIZE", "50"))
+MEMBER_MAX_PAGE_SIZE = int(os.getenv("MEMBER_MAX_PAGE_SIZE", "200"))
+MEMBER_FIELDS = ("uid", "name", "role", "joined_at")
+
+def uses_member_collection():
+    return MEMBER_STORAGE == "collection"
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+
+def parse_fields(fields):
+    # Comma separated subset of MEMBER_FIELDS, all of them when not given
+    if not fields:
+        return MEMBER_FIELDS
+    selected = tuple(field.strip() for field in fields.split(",") if field.strip())
+    unknown = [field for field in selected if field not in MEMBER_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown member fields {', '.join(unknown)}")
+    return selected
+
+def new_member(uid, name, role, joined_at=None):
+    return {"uid": uid, "name": name, "role": role, "joined_at": joined_at or datetime.utcnow()}
+
+def split_members(support_group):
+    # For a new group: the document to insert and the members to store separately, if any
+    if not uses_member_collection():
+        return support_group, []
+    group = {key: value for key, value in support_group.items() if key != "members"}
+    return group, support_group.get("members", [])
+
+def insert_members(group_id, members, session=None):
+    if members:
+        member_collection.insert_many(
+            [{**member, "support_group_id": str(group_id)} for member in members],
+            session=session
+        )
+
+def add_member(group_id, member, session=None):
+    # Returns False when the user already is a member; both paths are a single atomic write.
+    # Joins leave the group document alone in collection mode, so they stay one write.
+    if uses_member_collection():
+        try:
+            member_collection.insert_one({**member, "support_group_id": str(group_id)}, session=session)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    result = support_group_collection.update_one(
+        {"_id": ObjectId(group_id), "members.uid": {"$ne": member["uid"]}},
+        {"$push": {"members": member}, "$set": {"updated_at": datetime.utcnow()}},
+        session=session
+    )
+    return bool(result.matched_count)
+
+def get_member(group_id, uid):
+    if uses_member_collection():
+        return member_collection.find_one(
+            {"support_group_id": str(group_id), "uid": uid},
+            {"_id": 0, "support_group_id": 0}
+        )
+
+    group = support_group_collection.find_one(
+        {"_id": ObjectId(group_id), "members.uid": uid},
+        {"members.$": 1}
+    )
+    return group["members"][0] if group else None
+
+def get_memberships(uid):
+    # {group_id: {"name", "role"}} for every support group the user belongs to
+    if uses_member_collection():
+        roles = {
+            member["support_group_id"]: member.get("role")
+            for member in member_collection.find({"uid": uid}, {"support_group_id": 1, "role": 1})
+        }
+        if not roles:
+            return {}
+        groups = support_group_collection.find(
+            {"_id": {"$in": [ObjectId(group_id) for group_id in roles]}},
+            {"name": 1}
+        )
+        return {
+            str(group["_id"]): {"name": group.get("name"), "role": roles[str(group["_id"])]}
+            for group in groups
+        }
+
+    memberships = {}
+    for group in support_group_collection.find({"members.uid": uid}, {"name": 1, "members.$": 1}):
+        members = group.get("members") or [{}]
+        memberships[str(group["_id"])] = {"name": group.get("name"), "role": members[0].get("role")}
+    return memberships
+
+def list_members(group_id, limit=MEMBER_PAGE_SIZE, cursor=None, fields=MEMBER_FIELDS):
+    # Returns (members, next_cursor); the payload only depends on the page size
+    limit = min(max(limit, 1), MEMBER_MAX_PAGE_SIZE)
+    position = decode_cursor(cursor) if cursor else None
+
+    if uses_member_collection():
+        # Keyset pagination on (joined_at, _id) over the support_group_id index
+        query = {"support_group_id": str(group_id)}
+        if position:
+            joined_at, last_id = datetime.fromisoformat(position[0]), ObjectId(position[1])
+            query["$or"] = [
+                {"joined_at": {"$gt": joined_at}},
+                {"joined_at": joined_at, "_id": {"$gt": last_id}}
+            ]
+        projection = {field: 1 for field in fields}
+        projection["joined_at"] = 1
+        members = list(member_collection.find(
+            query,
+            projection,
+            sort=[("joined_at", ASCENDING), ("_id", ASCENDING)],
+            limit=limit + 1
+        ))
+        has_more = len(members) > limit
+        members = members[:limit]
+        next_cursor = None
+        if has_more:
+            last = members[-1]
+            next_cursor = encode_cursor([last["joined_at"].isoformat(), str(last["_id"])])
+        return [{field: member.get(field) for field in fields} for member in members], next_cursor
+
+    # Embedded members are paged with $slice and projected server-side
+    offset = position or 0
+    result = list(support_group_collection.aggregate([
+        {"$match": {"_id": ObjectId(group_id)}},
+        {"$project": {"members": {"$map": {
+            "input": {"$slice": [{"$ifNull": ["$members", []]}, offset, limit + 1]},
+            "as": "member",
+            "in": {field: f"$$member.{field}" for field in fields}
+        }}}}
+    ]))
+    if not result:
+        return None, None
+    members = result[0]["members"]
+    has_more = len(members) > limit
+    return members[:limit], encode_cursor(offset + limit) if has_more else None
+
+def update_member(group_id, uid, changes):
+    # changes is a dict of member fields to set, e.g. {"name": ...} or {"role": ...}
+    now = datetime.utcnow()
+    if uses_member_collection():
+        result = member_collection.update_one(
+            {"support_group_id": str(group_id), "uid": uid},
+            {"$set": changes}
+        )
+        if result.modified_count:
+            support_group_collection.update_one({"_id": ObjectId(group_id)}, {"$set": {"updated_at": now}})
+        return bool(result.modified_count)
+
+    result = support_group_collection.update_one(
+        {"_id": ObjectId(group_id), "members.uid": uid},
+        {"$set": {**{f"members.$.{field}": value for field, value in changes.items()}, "updated_at": now}}
+    )
+    return bool(result.modified_count)
+
+def remove_member(group_id, uid):
+    now = datetime.utcnow()
+    if uses_member_collection():
+        result = member_collection.delete_one({"support_group_id": str(group_id), "uid": uid})
+        if result.deleted_count:
+            support_group_collection.update_one({"_id": ObjectId(group_id)}, {"$set": {"updated_at": now}})
+        return bool(result.deleted_count)
+
+    result = support_group_collection.update_one(
+        {"_id": ObjectId(group_id)},
+        {"$pull": {"members": {"uid": uid}}, "$set": {"updated_at": now}}
+    )
+    return bool(result.modified_count)
+
+def delete_members(group_id, session=None):
+    # Embedded members go away with the group document itself
+    if uses_member_collection():
+        member_collection.delete_many({"support_group_id": str(group_id)}, session=session)
+
+def migrate_members(group_id=None):
+    # Makes support_group_members mirror the embedded members: current fields are copied over and rows
+    # for members removed since an earlier run are deleted. The embedded array is left untouched and the
+    # copied uids are recorded for prune_members. Embedded members are the source of truth, so this only
+    # runs before the switch; the final run should be the last thing before it.
+    if uses_member_collection():
+        raise RuntimeError("Copy members before setting SUPPORT_GROUP_MEMBER_STORAGE=collection, not after")
+    query = {"$or": [{"members.0": {"$exists": True}}, {"migrated_member_uids.0": {"$exists": True}}]}
+    if group_id:
+        query["_id"] = ObjectId(group_id)
+    migrated = 0
+    for group in support_group_collection.find(query, {"members": 1}):
+        group_id = str(group["_id"])
+        members = group.get("members") or []
+        uids = [member["uid"] for member in members]
+        operations = [
+            UpdateOne(
+                {"support_group_id": group_id, "uid": member["uid"]},
+                {"$set": {**member, "support_group_id": group_id}},
+                upsert=True
+            )
+            for member in members
+        ]
+        operations.append(DeleteMany({"support_group_id": group_id, "uid": {"$nin": uids}}))
+        member_collection.bulk_write(operations, ordered=False)
+        support_group_collection.update_one({"_id": group["_id"]}, {"$set": {"migrated_member_uids": uids}})
+        migrated += 1
+    return migrated
+
+def prune_members(group_id=None):
+    # Drops embedded members that migrate_members copied, once reads and writes use the collection.
+    # Only the recorded uids are pulled, so nothing that was never copied is lost.
+    if not uses_member_collection():
+        raise RuntimeError("Set SUPPORT_GROUP_MEMBER_STORAGE=collection before pruning embedded members")
+    query = {"migrated_member_uids.0": {"$exists": True}}
+    if group_id:
+        query["_id"] = ObjectId(group_id)
+    pruned = 0
+    for group in support_group_collection.find(query, {"migrated_member_uids": 1}):
+        support_group_collection.update_one(
+            {"_id": group["_id"]},
+            {
+                "$pull": {"members": {"uid": {"$in": group["migrated_member_uids"]}}},
+                "$unset": {"migrated_member_uids": ""}
+            }
+        )
+        pruned += 1
+    return pruned
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy embedded support group members into their own collection")
+    parser.add_argument("--group", help="only migrate this support group id")
+    parser.add_argument("--prune", action="store_true",
+                        help="remove copied embedded members, after switching to SUPPORT_GROUP_MEMBER_STORAGE=collection")
+    args = parser.parse_args()
+
+    if args.prune:
+        print(f"Pruned embedded members from {prune_members(args.group)} support groups")
+    else:
+        print(f"Migrated {migrate_members(args.group)} support groups")
@@ -0,0 +1,4 @@
+import os
+
+# src.config.gemini configures the SDK at import time; tests only ever use fake models
+os.environ.setdefault("GEMINI_API_KEY", "test")
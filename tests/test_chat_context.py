@@ -0,0 +1,37 @@
+from bson import ObjectId
+import asyncio
+import mongomock
+import pytest
+
+from src.config import gemini, mongodb
+from src.controller import chat_controller
+
+class RecordingModel:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        return type("Response", (), {"text": "answer"})()
+
+@pytest.fixture
+def model(monkeypatch):
+    recording_model = RecordingModel()
+    monkeypatch.setattr(gemini, "model", recording_model)
+    monkeypatch.setattr(gemini, "get_context_document", lambda child_id: {"content": "Diagnosis notes", "version": "kb:1"})
+    return recording_model
+
+def test_first_message_includes_the_diagnosis_document(model):
+    asyncio.run(gemini.respond_to_message("How do I help?", first_message=True, use_cache=False, child_id="child"))
+    asyncio.run(gemini.respond_to_message("And now?", use_cache=False, child_id="child"))
+    assert "Diagnosis notes" in model.prompts[0]
+    assert "Diagnosis notes" not in model.prompts[1]
+
+def test_is_first_message_ignores_the_queued_chat(monkeypatch):
+    mongo_client = mongomock.MongoClient()
+    monkeypatch.setattr(mongodb, "get_client", lambda: mongo_client)
+    child_id = ObjectId()
+    chat_id = mongodb.get_db().chat.insert_one({"child_id": child_id, "question": "First"}).inserted_id
+    assert chat_controller.is_first_message(child_id, chat_id)
+    mongodb.get_db().chat.insert_one({"child_id": child_id, "question": "Second"})
+    assert not chat_controller.is_first_message(child_id, chat_id)
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+import threading
+import mongomock
+
+from src.service.chat_jobs import ChatJobQueue, STATUS_COMPLETED, STATUS_DEAD_LETTER, STATUS_PROCESSING
+
+def new_queue(collection, handler, **settings):
+    return ChatJobQueue(collection, handler, workers=2, retry_delay=0, **settings)
+
+def test_periodic_sweep_recovers_orphans_but_not_live_jobs():
+    collection = mongomock.MongoClient().db.chat
+    stale = datetime.now() - timedelta(seconds=600)
+    orphan_id = collection.insert_one({"question": "Orphan", "status": STATUS_PROCESSING, "attempts": 1, "updated_at": stale}).inserted_id
+
+    release = threading.Event()
+    handled = []
+
+    def handler(chat):
+        handled.append(chat["question"])
+        if chat["question"] == "Live":
+            release.wait(5)
+        return "Response"
+
+    queue = new_queue(collection, handler)
+    live_id = queue.submit({"question": "Live"})
+    # The live job looks stale too, as if its worker had been busy for a long time
+    collection.update_one({"_id": live_id}, {"$set": {"updated_at": stale}})
+
+    queue.start_recovery(interval=0.05, stale_after=300)
+    try:
+        deadline = datetime.now() + timedelta(seconds=5)
+        while collection.find_one({"_id": orphan_id})["status"] != STATUS_COMPLETED and datetime.now() < deadline:
+            threading.Event().wait(0.01)
+    finally:
+        release.set()
+        queue.shutdown()
+        queue.recovery_thread.join(timeout=1)
+
+    assert collection.find_one({"_id": orphan_id})["attempts"] == 2
+    assert handled.count("Live") == 1
+    assert queue.get_stats()["recovered"] == 1
+    assert collection.find_one({"_id": live_id})["status"] == STATUS_COMPLETED
+
+def run_to_end(queue, chat_data):
+    chat_id = queue.submit(chat_data)
+    queue.shutdown()
+    return queue.collection.find_one({"_id": chat_id})
+
+def test_failed_attempts_are_retried():
+    failures = []
+
+    def handler(chat):
+        if len(failures) < 2:
+            failures.append(chat["_id"])
+            raise RuntimeError("Gemini unavailable")
+        return "Response"
+
+    queue = new_queue(mongomock.MongoClient().db.chat, handler, max_attempts=3)
+    chat = run_to_end(queue, {"question": "Question"})
+    assert chat["status"] == STATUS_COMPLETED
+    assert chat["attempts"] == 3
+    assert chat["response"] == "Response"
+    assert "error" not in chat
+    assert queue.get_stats()["retried"] == 2
+
+def test_job_out_of_attempts_is_dead_lettered():
+    def handler(chat):
+        raise RuntimeError("Gemini unavailable")
+
+    queue = new_queue(mongomock.MongoClient().db.chat, handler, max_attempts=2)
+    chat = run_to_end(queue, {"question": "Question"})
+    assert chat["status"] == STATUS_DEAD_LETTER
+    assert chat["attempts"] == 2
+    assert chat["error"] == "Gemini unavailable"
+    assert queue.get_stats()["dead_lettered"] == 1
+    assert queue.get_stats()["outstanding"] == 0
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from flask import Flask
+import threading
+import asyncio
+import time
+import pytest
+
+from src.controller import chat_controller
+
+class FakeAsyncCollection:
+    # Serves one chat document, optionally deleting it once the wait is over
+    def __init__(self, chat):
+        self.chat = chat
+
+    async def find_one(self, query, projection=None):
+        return self.chat
+
+@pytest.fixture
+def chat():
+    return {"_id": ObjectId(), "child_id": ObjectId(), "question": "Question", "status": "pending",
+            "created_at": chat_controller.datetime.now()}
+
+@pytest.fixture
+def client(monkeypatch, chat):
+    monkeypatch.setattr(chat_controller, "async_collection", FakeAsyncCollection(chat))
+    monkeypatch.setattr(chat_controller, "long_poll_slots", threading.BoundedSemaphore(2))
+
+    async def wait(chat_id, timeout):
+        await asyncio.sleep(0.3)
+        return True
+
+    monkeypatch.setattr(chat_controller.chat_jobs, "wait", wait)
+    app = Flask(__name__)
+    app.register_blueprint(chat_controller.chat_controller)
+    return app.test_client()
+
+def url(chat, wait):
+    return f"/api/chat/{chat['child_id']}/{chat['_id']}?wait={wait}"
+
+def test_long_polls_beyond_the_slots_answer_right_away(client, chat):
+    def poll():
+        started_at = time.perf_counter()
+        assert client.get(url(chat, 5)).status_code == 200
+        return time.perf_counter() - started_at
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        elapsed = sorted(executor.map(lambda _: poll(), range(4)))
+
+    assert elapsed[1] < 0.2
+    assert elapsed[2] >= 0.3
+
+def test_invalid_wait_is_rejected(client, chat):
+    assert client.get(url(chat, "soon")).status_code == 400
+
+def test_chat_deleted_while_polling_is_not_found(client, chat, monkeypatch):
+    async def wait(chat_id, timeout):
+        chat_controller.async_collection.chat = None
+        return True
+
+    monkeypatch.setattr(chat_controller.chat_jobs, "wait", wait)
+    assert client.get(url(chat, 5)).status_code == 404
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+import time
+import mongomock
+import pytest
+
+from src.config import gemini, mongodb
+from src.service import conversation_memory
+
+class SummaryModel:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        return type("Response", (), {"text": "Notes"})()
+
+@pytest.fixture
+def model(monkeypatch):
+    mongo_client = mongomock.MongoClient()
+    monkeypatch.setattr(mongodb, "get_client", lambda: mongo_client)
+    summary_model = SummaryModel()
+    monkeypatch.setattr(gemini, "model", summary_model)
+    return summary_model
+
+def add_turns(child_id, count):
+    started_at = datetime.now() - timedelta(minutes=count)
+    mongodb.get_db().chat.insert_many([
+        {"child_id": child_id, "question": f"Q{index}", "response": f"A{index}", "created_at": started_at + timedelta(minutes=index)}
+        for index in range(count)
+    ])
+
+def refresh(child_id):
+    conversation_memory.schedule_summary_refresh(child_id)
+    deadline = time.monotonic() + 5
+    while child_id in conversation_memory.refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_summary_takes_a_gemini_slot_only_when_a_batch_is_due(model):
+    child_id = ObjectId()
+    submitted = gemini.get_gemini_stats()["completed"] + gemini.get_gemini_stats()["failed"]
+    add_turns(child_id, conversation_memory.CHAT_MEMORY_TURNS + conversation_memory.CHAT_SUMMARY_BATCH - 1)
+    refresh(child_id)
+    assert model.prompts == []
+    assert gemini.get_gemini_stats()["completed"] + gemini.get_gemini_stats()["failed"] == submitted
+
+    add_turns(child_id, 1)
+    refresh(child_id)
+    assert len(model.prompts) == 1
+    memory = mongodb.get_db().chat_memory.find_one({"_id": child_id})
+    assert memory["summary"] == "Notes"
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import asyncio
+import pytest
+
+from src.config import gemini
+
+class SlowModel:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        threading.Event().wait(self.delay)
+        return type("Response", (), {"text": f"answer to {prompt}"})()
+
+@pytest.fixture
+def pool(monkeypatch):
+    # One slot, so a single blocked call makes every other one queue
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-test")
+    monkeypatch.setattr(gemini, "gemini_executor", executor)
+    monkeypatch.setattr(gemini, "GEMINI_QUEUE_TIMEOUT", 0.1)
+    yield executor
+    executor.shutdown(wait=True)
+
+def occupy_slot():
+    release = threading.Event()
+    gemini.submit_to_gemini_pool(release.wait, 5)
+    return release
+
+def test_call_that_waits_too_long_for_a_slot_is_rejected(pool, monkeypatch):
+    model = SlowModel()
+    monkeypatch.setattr(gemini, "model", model)
+    timeouts = gemini.get_gemini_stats()["queue_timeouts"]
+    release = occupy_slot()
+    try:
+        with pytest.raises(gemini.GeminiBusyError):
+            asyncio.run(gemini.generate_async("Question"))
+    finally:
+        release.set()
+    assert model.prompts == []
+    assert gemini.get_gemini_stats()["queue_timeouts"] == timeouts + 1
+
+def test_call_that_started_is_not_cut_off_by_the_queue_timeout(pool, monkeypatch):
+    monkeypatch.setattr(gemini, "model", SlowModel(delay=0.3))
+    assert asyncio.run(gemini.generate_async("Question")) == "answer to Question"
+
+async def ask_together(*prompts):
+    return await asyncio.gather(*[gemini.generate_async(prompt) for prompt in prompts], return_exceptions=True)
+
+def test_identical_prompts_share_one_upstream_call(pool, monkeypatch):
+    model = SlowModel()
+    monkeypatch.setattr(gemini, "model", model)
+    monkeypatch.setattr(gemini, "GEMINI_QUEUE_TIMEOUT", 5)
+    coalesced = gemini.get_gemini_stats()["coalesced"]
+
+    answers = asyncio.run(ask_together("Question", "Question", "Question"))
+    assert answers == ["answer to Question"] * 3
+    assert model.prompts == ["Question"]
+    assert gemini.get_gemini_stats()["coalesced"] == coalesced + 2
+    assert gemini.inflight_calls == {}
+
+    # Once the leader finished, the same prompt makes a new call
+    asyncio.run(gemini.generate_async("Question"))
+    assert model.prompts == ["Question", "Question"]
+
+def test_followers_fail_with_the_leader_when_it_times_out_in_the_queue(pool, monkeypatch):
+    model = SlowModel()
+    monkeypatch.setattr(gemini, "model", model)
+    release = occupy_slot()
+    try:
+        answers = asyncio.run(ask_together("Question", "Question"))
+    finally:
+        release.set()
+    assert all(isinstance(answer, gemini.GeminiBusyError) for answer in answers)
+    assert model.prompts == []
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import Flask
+import mongomock
+import pytest
+
+from src.config import mongodb
+from src.config.indexes import ensure_indexes
+from src.controller import chat_controller
+from src.service import knowledge_base_files, support_group_members
+
+# Several documents share a timestamp, so pages have to break ties on _id
+TIMESTAMPS = 7
+PER_TIMESTAMP = 3
+TOTAL = TIMESTAMPS * PER_TIMESTAMP
+
+@pytest.fixture
+def database(monkeypatch):
+    mongo_client = mongomock.MongoClient()
+    monkeypatch.setattr(mongodb, "get_client", lambda: mongo_client)
+    ensure_indexes(mongodb.get_db())
+    return mongodb.get_db()
+
+def timestamps():
+    started_at = datetime(2024, 1, 1)
+    for index in range(TIMESTAMPS):
+        for _ in range(PER_TIMESTAMP):
+            yield started_at + timedelta(minutes=index)
+
+def walk(fetch_page):
+    # Follows next cursors to the end; returns every id seen, page by page
+    pages, cursor = [], None
+    while True:
+        ids, cursor = fetch_page(cursor)
+        pages.append(ids)
+        if cursor is None:
+            return pages
+
+def assert_complete(pages, expected_ids, limit):
+    seen = [item for page in pages for item in page]
+    assert seen == expected_ids
+    assert all(len(page) == limit for page in pages[:-1])
+
+@pytest.mark.parametrize("limit", [1, 4, TOTAL, TOTAL + 1])
+def test_chat_pages_cover_the_history_once(database, limit):
+    child_id = ObjectId()
+    database.chat.insert_many([
+        {"child_id": child_id, "question": "Question", "response": "Response", "created_at": created_at}
+        for created_at in timestamps()
+    ])
+    app = Flask(__name__)
+
+    def fetch_page(cursor):
+        query = f"limit={limit}" + (f"&next={cursor}" if cursor else "")
+        with app.test_request_context(f"/api/chat/{child_id}?{query}"):
+            response, status = chat_controller.list_chats(str(child_id))
+        assert status == 200
+        body = response.get_json()
+        return [chat["_id"] for chat in body["data"]], body["next"]
+
+    expected = [str(chat["_id"]) for chat in database.chat.find().sort([("created_at", -1), ("_id", -1)])]
+    assert_complete(walk(fetch_page), expected, limit)
+
+def test_invalid_chat_cursor_is_rejected(database):
+    with Flask(__name__).test_request_context(f"/api/chat/{ObjectId()}?next=bogus"):
+        _, status = chat_controller.list_chats(str(ObjectId()))
+    assert status == 400
+
+@pytest.mark.parametrize("storage", ["embedded", "collection"])
+@pytest.mark.parametrize("limit", [1, 4, TOTAL])
+def test_member_pages_cover_the_group_once(database, monkeypatch, storage, limit):
+    monkeypatch.setattr(support_group_members, "MEMBER_STORAGE", storage)
+    members = [support_group_members.new_member(f"member-{index}", "Member", "none", joined_at)
+               for index, joined_at in enumerate(timestamps())]
+    group, separate = support_group_members.split_members({"name": "Support group", "members": members})
+    group_id = database.support_group.insert_one(group).inserted_id
+    support_group_members.insert_members(group_id, separate)
+
+    def fetch_page(cursor):
+        page, next_cursor = support_group_members.list_members(str(group_id), limit=limit, cursor=cursor, fields=("uid",))
+        return [member["uid"] for member in page], next_cursor
+
+    pages = walk(fetch_page)
+    assert sorted(uid for page in pages for uid in page) == sorted(member["uid"] for member in members)
+    assert all(len(page) == limit for page in pages[:-1])
+
+@pytest.mark.parametrize("limit", [1, 4, TOTAL])
+def test_file_pages_cover_the_knowledge_base_once(database, limit):
+    child_id = str(ObjectId())
+    database.knowledge_base_files.insert_many([
+        knowledge_base_files.file_record(child_id, f"{child_id}/{index}.pdf", f"{index}.pdf", 1, "application/pdf",
+                                         uploaded_at=uploaded_at)
+        for index, uploaded_at in enumerate(timestamps())
+    ])
+
+    def fetch_page(cursor):
+        records, next_cursor = knowledge_base_files.list_files(child_id, limit=limit, cursor=cursor)
+        return [record["key"] for record in records], next_cursor
+
+    expected = [record["key"] for record in database.knowledge_base_files.find().sort([("uploaded_at", -1), ("_id", -1)])]
+    assert_complete(walk(fetch_page), expected, limit)
@@ -0,0 +1,51 @@
+import asyncio
+
+from src.config.server import ThreadedWsgiToAsgi
+
+class ClosingBody:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+def call(asgi_app):
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": [], "http_version": "1.1"}
+    requests = [{"type": "http.request", "body": b""}]
+    sent = []
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    return sent
+
+def test_response_is_relayed_and_closed():
+    body = ClosingBody([b"hello ", b"world", b" and more"])
+
+    def wsgi_app(environ, start_response):
+        start_response("201 Created", [("Content-Type", "text/plain"), ("Content-Length", "11")])
+        return body
+
+    sent = call(ThreadedWsgiToAsgi(wsgi_app))
+    assert sent[0] == {"type": "http.response.start", "status": 201,
+                       "headers": [(b"content-type", b"text/plain"), (b"content-length", b"11")]}
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"hello world"
+    assert sent[-1] == {"type": "http.response.body"}
+    assert body.closed
+
+def test_empty_response_still_starts():
+    def wsgi_app(environ, start_response):
+        start_response("204 No Content", [])
+        return []
+
+    sent = call(ThreadedWsgiToAsgi(wsgi_app))
+    assert [message["type"] for message in sent] == ["http.response.start", "http.response.body"]
+    assert sent[0]["status"] == 204
@@ -0,0 +1,25 @@
+import time
+
+from src.config.firebase import SigningKeyManager
+
+def test_unknown_kids_refresh_at_most_once_per_interval():
+    fetches = []
+
+    def key_source():
+        fetches.append(time.monotonic())
+        return {}, 3600
+
+    manager = SigningKeyManager(key_source=key_source, retry_interval=0.5)
+    manager.start()
+    try:
+        deadline = time.monotonic() + 1.2
+        while time.monotonic() < deadline:
+            assert manager.get_key("bogus") is None
+            time.sleep(0.001)
+    finally:
+        manager.stop()
+        manager.thread.join(timeout=1)
+
+    # The startup load plus one delayed fetch per elapsed interval
+    assert len(fetches) <= 4
+    assert all(later - earlier >= 0.45 for earlier, later in zip(fetches, fetches[1:]))
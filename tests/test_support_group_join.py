@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+import threading
+import mongomock
+import pytest
+
+from src.config import mongodb
+from src.config.indexes import ensure_indexes
+from src.middleware import auth_middleware
+from src.service import support_group_members
+from src.controller.support_group_controller import support_group_controller
+
+JOINS = 16
+
+@pytest.fixture(params=["embedded", "collection"])
+def client(request, monkeypatch):
+    mongo_client = mongomock.MongoClient()
+    monkeypatch.setattr(mongodb, "get_client", lambda: mongo_client)
+    monkeypatch.setattr(support_group_members, "MEMBER_STORAGE", request.param)
+    monkeypatch.setattr(auth_middleware, "verify_token", lambda token, check_revoked=False: {"uid": token, "name": token})
+    ensure_indexes(mongodb.get_db())
+
+    app = Flask(__name__)
+    app.register_blueprint(support_group_controller)
+    return app.test_client()
+
+@pytest.fixture
+def group_id():
+    db = mongodb.get_db()
+    group, members = support_group_members.split_members({
+        "name": "Support group",
+        "members": [support_group_members.new_member("parent", "Parent", "admin")]
+    })
+    group_id = db.support_group.insert_one(group).inserted_id
+    support_group_members.insert_members(group_id, members)
+    db.child.insert_one({"name": "Child", "support_code": "123456", "support_group_id": str(group_id)})
+    return str(group_id)
+
+def test_concurrent_joins_add_one_member(client, group_id):
+    start = threading.Barrier(JOINS)
+
+    def join():
+        start.wait()
+        return client.post(
+            "/api/support-group/join",
+            json={"code": "123456"},
+            headers={"Authorization": "Bearer member"}
+        ).status_code
+
+    with ThreadPoolExecutor(max_workers=JOINS) as executor:
+        statuses = list(executor.map(lambda _: join(), range(JOINS)))
+
+    assert statuses.count(200) == 1
+    assert statuses.count(400) == JOINS - 1
+    members, _ = support_group_members.list_members(group_id, fields=("uid", "role"))
+    assert [member for member in members if member["uid"] == "member"] == [{"uid": "member", "role": "none"}]
+
+def test_join_twice_is_rejected(client, group_id):
+    headers = {"Authorization": "Bearer member"}
+    assert client.post("/api/support-group/join", json={"code": "123456"}, headers=headers).status_code == 200
+    assert client.post("/api/support-group/join", json={"code": "123456"}, headers=headers).status_code == 400
+
+def test_members_listing_shows_a_code_changed_by_another_worker(client, group_id):
+    headers = {"Authorization": "Bearer parent"}
+    mongodb.get_db().child.update_one({"support_group_id": group_id}, {"$set": {"parent_uid": "parent"}})
+    child_id = str(mongodb.get_db().child.find_one({"support_group_id": group_id})["_id"])
+    assert client.get(f"/api/support-group/{child_id}/members", headers=headers).get_json()["support_code"] == "123456"
+
+    # Another worker regenerates the code; this worker's access cache entry is still fresh
+    mongodb.get_db().child.update_one({"support_group_id": group_id}, {"$set": {"support_code": "654321"}})
+    assert client.get(f"/api/support-group/{child_id}/members", headers=headers).get_json()["support_code"] == "654321"
@@ -0,0 +1,49 @@
+from bson import ObjectId
+import mongomock
+import pytest
+
+from src.config import mongodb
+from src.config.indexes import ensure_indexes
+from src.service import support_group_members
+from src.service.support_group_members import new_member
+
+@pytest.fixture
+def group_id(monkeypatch):
+    mongo_client = mongomock.MongoClient()
+    monkeypatch.setattr(mongodb, "get_client", lambda: mongo_client)
+    monkeypatch.setattr(support_group_members, "MEMBER_STORAGE", "embedded")
+    ensure_indexes(mongodb.get_db())
+    group = {
+        "name": "Support group",
+        "members": [new_member("parent", "Parent", "admin"), new_member("m", "Member", "none")]
+    }
+    return str(mongodb.get_db().support_group.insert_one(group).inserted_id)
+
+def switch_storage(monkeypatch):
+    monkeypatch.setattr(support_group_members, "MEMBER_STORAGE", "collection")
+
+def test_copy_again_reconciles_changes_made_before_the_switch(group_id, monkeypatch):
+    support_group_members.migrate_members()
+    support_group_members.remove_member(group_id, "m")
+    support_group_members.update_member(group_id, "parent", {"role": "viewer"})
+    support_group_members.add_member(group_id, new_member("late", "Late joiner", "none"))
+    support_group_members.migrate_members()
+
+    switch_storage(monkeypatch)
+    assert support_group_members.get_member(group_id, "m") is None
+    assert support_group_members.get_member(group_id, "parent")["role"] == "viewer"
+    assert support_group_members.get_member(group_id, "late")["name"] == "Late joiner"
+
+def test_prune_removes_only_copied_members(group_id, monkeypatch):
+    support_group_members.migrate_members()
+    switch_storage(monkeypatch)
+    support_group_members.add_member(group_id, new_member("new", "New member", "none"))
+    with pytest.raises(RuntimeError):
+        support_group_members.migrate_members()
+
+    support_group_members.prune_members()
+    group = mongodb.get_db().support_group.find_one({"_id": ObjectId(group_id)})
+    assert group["members"] == []
+    assert "migrated_member_uids" not in group
+    members, _ = support_group_members.list_members(group_id, fields=("uid",))
+    assert sorted(member["uid"] for member in members) == ["m", "new", "parent"]